@@ -0,0 +1,43 @@
+import contextlib
+import json
+import os
+import shutil
+import uuid
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    '''a temp path to write `path` through, moved into place when the block ends
+
+    Every call gets a temp file of its own next to `path`, so threads and
+    processes writing the same file never trip over each other's temp file,
+    and readers only ever see a complete file. The temp file is removed if
+    the block raises. The block may also make a directory at the temp path,
+    to replace a whole directory at once.
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode='w', **kwargs):
+    with atomic_path(path) as temp_path:
+        with open(temp_path, mode, **kwargs) as file:
+            yield file
+
+
+def write_json(path: str, obj, **kwargs):
+    with atomic_open(path, 'w', encoding='utf8') as file:
+        json.dump(obj, file, **kwargs)
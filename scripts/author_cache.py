@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_PATH = 'cache/authors.sqlite'
+
+DAY = 24 * 60 * 60
+
+# seconds each cached field stays valid; None never expires
+PROFILE_TTLS = {'account_created': None,
+                'suspended': 3 * DAY,
+                'comment_karma': 7 * DAY,
+                'post_karma': 7 * DAY,
+                'moderator_of': 7 * DAY,
+                'submissions': 1 * DAY}
+
+SCHEMA = '''
+create table if not exists profile_fields (
+    username text not null,
+    field text not null,
+    value text,
+    fetched_at real not null,
+    primary key (username, field)
+);
+
+create table if not exists submissions (
+    post_id text primary key,
+    username text not null,
+    timestamp integer not null,
+    record text not null
+);
+
+create index if not exists submissions_by_author
+    on submissions (username, timestamp);
+'''
+
+
+class AuthorCache:
+
+    def __init__(self, path=CACHE_PATH, ttls=PROFILE_TTLS):
+        self.ttls = dict(PROFILE_TTLS, **ttls)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # profiles and submissions are stored from the fetcher's worker
+        # threads, so the connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _is_fresh(self, field: str, fetched_at: float, now: float) -> bool:
+        ttl = self.ttls.get(field)
+        return ttl is None or now - fetched_at < ttl
+
+    def profile(self, username: str):
+        '''the cached profile, or None if it is missing or any field expired'''
+        with self.lock:
+            rows = self.connection.execute(
+                'select field, value, fetched_at from profile_fields '
+                'where username = ? and field != ? order by rowid',
+                (username, 'submissions')).fetchall()
+
+        if not rows:
+            return None
+
+        now = time.time()
+        if not all(self._is_fresh(field, fetched_at, now)
+                   for field, _, fetched_at in rows):
+            return None
+
+        user_profile = {'username': username}
+        user_profile.update({field: json.loads(value) for field, value, _ in rows})
+
+        return user_profile
+
+    def store_profile(self, user_profile: dict):
+        now = time.time()
+        username = user_profile['username']
+
+        rows = [(username, field, json.dumps(value), now)
+                for field, value in user_profile.items()
+                if field != 'username']
+
+        with self.lock, self.connection:
+            self.connection.execute('delete from profile_fields '
+                                    'where username = ? and field != ?',
+                                    (username, 'submissions'))
+            self.connection.executemany('insert into profile_fields '
+                                        'values (?, ?, ?, ?)', rows)
+
+    def submissions_are_fresh(self, username: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                'select fetched_at from profile_fields '
+                'where username = ? and field = ?',
+                (username, 'submissions')).fetchone()
+
+        return row is not None and self._is_fresh('submissions', row[0], time.time())
+
+    def latest_post_id(self, username: str):
+        with self.lock:
+            row = self.connection.execute(
+                'select value from profile_fields '
+                'where username = ? and field = ?',
+                (username, 'submissions')).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def store_submissions(self, username: str, post_records: list):
+        '''store the author's newest submissions, as just fetched
+
+        The records replace the cached ones they overlap, and cached posts
+        in the span they cover that are no longer listed are dropped as
+        deleted. Pinned posts head the listing whatever their age, so the
+        span is that of the newest first run of posts after them.
+        '''
+        timestamps = [int(p['timestamp']) for p in post_records]
+
+        start = len(timestamps) - 1
+        while start > 0 and timestamps[start - 1] >= timestamps[start]:
+            start -= 1
+
+        latest_post_id = (max(post_records, key=lambda p: int(p['timestamp']))['post_id']
+                          if post_records else None)
+        oldest_timestamp = min(timestamps[start:]) if post_records else None
+
+        rows = [(p['post_id'], username, int(p['timestamp']), json.dumps(p))
+                for p in post_records]
+
+        with self.lock, self.connection:
+            self.connection.execute('create temp table if not exists fetched (post_id text)')
+            self.connection.execute('delete from fetched')
+            self.connection.executemany('insert into fetched values (?)',
+                                        ((p['post_id'],) for p in post_records))
+
+            # an empty listing means every post is gone
+            self.connection.execute('delete from submissions '
+                                    'where username = ? and timestamp >= coalesce(?, 0) '
+                                    'and post_id not in (select post_id from fetched)',
+                                    (username, oldest_timestamp))
+
+            self.connection.executemany('insert or replace into submissions '
+                                        'values (?, ?, ?, ?)', rows)
+            self.connection.execute('insert or replace into profile_fields '
+                                    'values (?, ?, ?, ?)',
+                                    (username, 'submissions',
+                                     json.dumps(latest_post_id), time.time()))
+
+    def submissions(self, username: str, limit=None) -> list:
+        query = ('select record from submissions where username = ? '
+                 'order by timestamp desc')
+        params = (username,)
+
+        if limit is not None:
+            query += ' limit ?'
+            params += (limit,)
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+
+        return [json.loads(record) for record, in rows]
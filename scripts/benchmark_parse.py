@@ -0,0 +1,65 @@
+import sys
+import time
+
+from response_cache import ResponseCache, CACHE_DIR
+from scrape import SubredditScraper
+
+# run from the repository root after a scrape has filled the response cache:
+#   python scripts/benchmark_parse.py [cache directory | listing.html ...]
+
+ROUNDS = 5
+
+
+def cached_listing_pages(directory=CACHE_DIR) -> list:
+    cache = ResponseCache(directory)
+
+    pages = list()
+    for entry in cache.entries():
+        if entry is None or entry['status_code'] != 200:
+            continue
+
+        html = cache.body(entry).decode(entry['encoding'] or 'utf8', errors='replace')
+        if 'siteTable' in html:
+            pages.append(html)
+
+    return pages
+
+
+def benchmark(pages: list, rounds=ROUNDS) -> dict:
+    timings = dict()
+    listings = dict()
+
+    for parser in ('bs4', 'lxml'):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            listings[parser] = [SubredditScraper.parse_listing(html, parser)
+                                for html in pages]
+        timings[parser] = (time.perf_counter() - start) / (rounds * len(pages))
+
+    if listings['bs4'] != listings['lxml']:
+        raise AssertionError('lxml and bs4 parsers produced different records')
+
+    return timings
+
+
+def main(paths: list):
+    if not paths or len(paths) == 1 and not paths[0].endswith('.html'):
+        pages = cached_listing_pages(*paths)
+    else:
+        pages = [open(path, encoding='utf8').read() for path in paths]
+
+    if not pages:
+        print('no listing pages found')
+        return
+
+    timings = benchmark(pages)
+    post_count = sum(len(SubredditScraper.parse_listing(html)[0]) for html in pages)
+
+    print(f'{len(pages)} pages, {post_count} posts, identical records')
+    for parser, seconds in timings.items():
+        print(f'{parser:>5}: {seconds * 1000:8.2f} ms/page')
+    print(f'speedup: {timings["bs4"] / timings["lxml"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+# run from the repository root:
+#   python scripts/benchmark_startup.py
+
+ROUNDS = 5
+
+# modules that must not be pulled in just by importing a stage
+HEAVY_MODULES = ('selenium', 'nltk', 'bs4')
+
+STAGES = ('main', 'report', 'textual_analysis', 'scrape')
+
+PROBE = '''
+import sys, time
+sys.path.insert(0, 'scripts')
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, *[m for m in {heavy!r} if m in sys.modules])
+'''
+
+
+def import_time(module: str) -> tuple:
+    probe = PROBE.format(module=module, heavy=HEAVY_MODULES)
+
+    timings = list()
+    for _ in range(ROUNDS):
+        output = subprocess.run([sys.executable, '-c', probe], check=True,
+                                capture_output=True, text=True).stdout.split()
+        timings.append(float(output[0]))
+        loaded = output[1:]
+
+    return min(timings), loaded
+
+
+def main():
+    for module in STAGES:
+        seconds, loaded = import_time(module)
+        print(f'{module:>16}: {seconds * 1000:7.1f} ms  heavy: {", ".join(loaded) or "-"}')
+
+    _, loaded = import_time('report')
+    if 'selenium' in loaded:
+        raise AssertionError('importing report loads selenium')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+
+from concurrent.futures import Future
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+from rate_limit import RateLimiter
+
+
+UBLOCK_EXTENSION = 'ublock_origin-1.37.2-an+fx.xpi'
+
+POOL_SIZE = os.cpu_count() or 1
+
+# number of pages a driver may load before it is replaced; firefox grows
+# steadily over a long session, so recycling keeps memory bounded
+RECYCLE_AFTER = 50
+
+# attempts per task before giving up on it, in case it keeps crashing drivers
+MAX_ATTEMPTS = 3
+
+
+def driver_is_alive(driver) -> bool:
+    try:
+        driver.current_url
+    except WebDriverException:
+        return False
+    else:
+        return True
+
+
+class DriverPool:
+
+    def __init__(self, size=POOL_SIZE, headless=True,
+                 recycle_after=RECYCLE_AFTER, max_attempts=MAX_ATTEMPTS,
+                 rate_limiter=None, setup_driver=None):
+        self.recycle_after = recycle_after
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+        # called with every new driver before it takes its first task
+        self.setup_driver = setup_driver
+
+        # the extension is added to a single profile shared by every driver;
+        # writing the profile to disk isn't thread-safe, hence the lock
+        self.profile = webdriver.FirefoxProfile()
+        self.profile.add_extension(extension=UBLOCK_EXTENSION)
+        self.profile_lock = threading.Lock()
+
+        self.options = webdriver.FirefoxOptions()
+        self.options.headless = headless
+
+        self.tasks = queue.Queue()
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(size)]
+
+        for worker in self.workers:
+            worker.start()
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, func, *args) -> Future:
+        '''queue `func(driver, *args)` to run on the next free driver'''
+        future = Future()
+        self.tasks.put((future, func, args, 0))
+
+        return future
+
+    def map(self, func, iterable):
+        futures = [self.submit(func, n) for n in iterable]
+
+        return (future.result() for future in futures)
+
+    def _create_driver(self):
+        with self.profile_lock:
+            driver = webdriver.Firefox(self.profile, options=self.options)
+
+        if self.setup_driver is not None:
+            self.setup_driver(driver)
+
+        return driver
+
+    @staticmethod
+    def _quit_driver(driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def _work(self):
+        driver = None
+        page_count = 0
+
+        while True:
+            task = self.tasks.get()
+
+            if task is None:
+                break
+
+            future, func, args, attempt = task
+
+            # retried tasks were already marked as running on their first attempt
+            if attempt == 0 and not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                if driver is not None and page_count >= self.recycle_after:
+                    self._quit_driver(driver)
+                    driver = None
+
+                if driver is None:
+                    driver = self._create_driver()
+                    page_count = 0
+
+                self.rate_limiter.acquire()
+                result = func(driver, *args)
+                page_count += 1
+            except Exception as error:
+                self.rate_limiter.fail()
+
+                if driver is not None and driver_is_alive(driver):
+                    future.set_exception(error)
+                    continue
+
+                # the driver crashed (or never started); replace it and hand
+                # the task back to the queue so no work is lost
+                if driver is not None:
+                    self._quit_driver(driver)
+                driver = None
+
+                if attempt + 1 < self.max_attempts:
+                    self.tasks.put((future, func, args, attempt + 1))
+                else:
+                    future.set_exception(error)
+            else:
+                self.rate_limiter.succeed()
+                future.set_result(result)
+
+        if driver is not None:
+            self._quit_driver(driver)
@@ -0,0 +1,203 @@
+import bisect
+import csv
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+
+import pyarrow.parquet as pq
+
+from atomic import write_json
+
+
+DATA_DIR = 'data'
+
+CATALOG_FILE = 'catalog.json'
+
+# <subreddit>_<table>.<format>, plus the early layout that suffixed the date:
+# data/20211115/propaganda_posts_20211115.csv
+SNAPSHOT_FILE_PATTERN = re.compile(r'^(?P<subreddit>.+?)_'
+                                   r'(?P<table>author_submissions|posts|authors)'
+                                   r'(?:_(?P<date>\d{8}))?'
+                                   r'\.(?P<format>csv|json|parquet)$')
+
+# analysis outputs, catalogued too so their hashes are on hand
+ARTIFACT_FILES = ('author_terms.json', 'author_top_terms.parquet', 'title_terms.csv',
+                  'propaganda_posts.md', 'propaganda_users.md')
+
+FORMAT_PREFERENCE = ('parquet', 'csv', 'json')
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def count_rows(path: str, file_format: str):
+    if file_format == 'parquet':
+        return pq.ParquetFile(path).metadata.num_rows
+
+    if file_format == 'csv':
+        # titles can hold quoted newlines, so lines can't simply be counted
+        with open(path, encoding='utf8', newline='') as file:
+            return max(0, sum(1 for _ in csv.reader(file)) - 1)
+
+    with open(path, encoding='utf8') as file:
+        return len(json.load(file))
+
+
+def is_snapshot_date(name: str) -> bool:
+    try:
+        dt.datetime.strptime(name, '%Y%m%d')
+    except ValueError:
+        return False
+    else:
+        return True
+
+
+class Catalog:
+    '''manifest of every snapshot under data/, kept in data/catalog.json
+
+    For each date it lists the snapshot tables found (in any of their
+    formats and file layouts) and the analysis artifacts, each with its
+    path, row count, size and sha256. Files are only re-hashed when their
+    size or modification time changes.
+    '''
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, CATALOG_FILE)
+        self.snapshots = dict()
+        self._dates_by_table = None
+
+    @classmethod
+    def load(cls, data_dir=DATA_DIR):
+        catalog = cls(data_dir)
+
+        try:
+            with open(catalog.path, encoding='utf8') as file:
+                catalog.snapshots = json.load(file)['snapshots']
+        except FileNotFoundError:
+            pass
+
+        # pick up snapshot directories created without going through the sink
+        missing = [d for d in os.listdir(data_dir)
+                   if is_snapshot_date(d) and d not in catalog.snapshots]
+        if missing:
+            for date_str in missing:
+                catalog._scan(date_str)
+            catalog.save()
+
+        return catalog
+
+    def save(self):
+        write_json(self.path, {'snapshots': self.snapshots}, indent=1, sort_keys=True)
+
+    def _describe(self, path: str, file_format: str, previous: dict) -> dict:
+        stat = os.stat(path)
+
+        if (previous and previous['size'] == stat.st_size
+                and previous['mtime'] == stat.st_mtime):
+            return previous
+
+        rows = None if file_format == 'md' else count_rows(path, file_format)
+
+        return {'path': path.replace(os.sep, '/'),
+                'format': file_format,
+                'rows': rows,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'sha256': file_hash(path)}
+
+    def _scan(self, date_str: str):
+        directory = os.path.join(self.data_dir, date_str)
+        previous = self.snapshots.get(date_str, {'tables': {}, 'artifacts': {}})
+        previous_files = {f['path']: f for table in previous['tables'].values()
+                          for f in table}
+        previous_files.update({f['path']: f for f in previous['artifacts'].values()})
+
+        tables = dict()
+        artifacts = dict()
+
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            key = path.replace(os.sep, '/')
+
+            match = SNAPSHOT_FILE_PATTERN.match(name)
+            if match and name not in ARTIFACT_FILES:
+                entry = self._describe(path, match['format'], previous_files.get(key))
+                entry = dict(entry, subreddit=match['subreddit'])
+                tables.setdefault(match['table'], []).append(entry)
+            elif name in ARTIFACT_FILES:
+                file_format = name.rsplit('.', 1)[-1]
+                artifacts[name] = self._describe(path, file_format, previous_files.get(key))
+
+        for entries in tables.values():
+            entries.sort(key=lambda n: FORMAT_PREFERENCE.index(n['format']))
+
+        self.snapshots[date_str] = {'tables': tables, 'artifacts': artifacts}
+        self._dates_by_table = None
+
+    def register(self, date_str: str):
+        '''rescan one snapshot directory and save the catalog'''
+        self._scan(date_str)
+        self.save()
+
+    def refresh(self):
+        self.snapshots = {d: s for d, s in self.snapshots.items()
+                          if os.path.isdir(os.path.join(self.data_dir, d))}
+
+        for date_str in os.listdir(self.data_dir):
+            if is_snapshot_date(date_str):
+                self._scan(date_str)
+
+        self.save()
+
+    def dates(self, tables=()) -> list:
+        '''sorted dates of the snapshots that hold every one of `tables`'''
+        if self._dates_by_table is None:
+            self._dates_by_table = dict()
+
+        key = tuple(sorted(tables))
+        if key not in self._dates_by_table:
+            self._dates_by_table[key] = sorted(
+                d for d, s in self.snapshots.items()
+                if all(t in s['tables'] for t in tables))
+
+        return self._dates_by_table[key]
+
+    def latest_before(self, date_str: str, min_days=0, tables=()):
+        '''the newest snapshot at least `min_days` older than `date_str`'''
+        cutoff = dt.datetime.strptime(date_str, '%Y%m%d') - dt.timedelta(days=min_days)
+        cutoff_str = cutoff.strftime('%Y%m%d')
+
+        dates = self.dates(tables)
+        i = bisect.bisect_right(dates, cutoff_str)
+
+        return dates[i - 1] if i > 0 else None
+
+    def latest(self, tables=()):
+        dates = self.dates(tables)
+        return dates[-1] if dates else None
+
+    def files(self, date_str: str, table: str) -> list:
+        '''the table's files for a date, preferred format first'''
+        return self.snapshots.get(date_str, {'tables': {}})['tables'].get(table, [])
+
+    def file(self, date_str: str, table: str, formats=FORMAT_PREFERENCE):
+        for entry in self.files(date_str, table):
+            if entry['format'] in formats:
+                return entry
+
+        return None
+
+
+if __name__ == '__main__':
+    Catalog.load().refresh()
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+from atomic import write_json
+
+
+CONSENT_PATH = 'cache/consent.json'
+
+REDDIT_DOMAIN = 'reddit.com'
+
+# the only cookies kept: over18 is set by the over18 form, _options holds
+# the quarantine opt-ins
+CONSENT_COOKIES = ('over18', '_options')
+
+# seconds a consent cookie set for the browser session only is kept
+SESSION_COOKIE_LIFETIME = 24 * 60 * 60
+
+
+def is_over_18_gate(response) -> bool:
+    '''whether a response was bounced to the over18 interstitial'''
+    redirects = [r.headers.get('location') or '' for r in response.history]
+
+    return any('/over18' in url for url in [response.url] + redirects)
+
+
+class ConsentStore:
+    '''reddit's over18/quarantine consent cookies, kept between runs
+
+    The cookies are loaded into every requests session and browser driver
+    the scraper starts, so the consent forms are only submitted when reddit
+    actually asks for them. Each subreddit's quarantine status is kept too,
+    since a quarantined subreddit no longer redirects once consent is given.
+    '''
+
+    def __init__(self, path=CONSENT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cookies = list()
+        self.quarantined = dict()
+
+        try:
+            with open(path, encoding='utf8') as file:
+                consent = json.load(file)
+        except FileNotFoundError:
+            pass
+        else:
+            now = time.time()
+            self.cookies = [c for c in consent['cookies']
+                            if c['name'] in CONSENT_COOKIES
+                            and c['expires'] is not None and c['expires'] > now]
+            self.quarantined = consent['quarantined']
+
+    def save(self):
+        write_json(self.path, {'cookies': self.cookies, 'quarantined': self.quarantined},
+                   indent=1)
+
+    def has_over_18(self) -> bool:
+        with self.lock:
+            return any(c['name'] == 'over18' for c in self.cookies)
+
+    def apply_to_session(self, session):
+        with self.lock:
+            for c in self.cookies:
+                session.cookies.set(c['name'], c['value'],
+                                    domain=c['domain'], path=c['path'])
+
+    def apply_to_driver(self, driver, root_url: str, rate_limiter=None):
+        with self.lock:
+            cookies = list(self.cookies)
+
+        if not cookies:
+            return
+
+        # cookies can only be set for the domain the driver is currently on
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        driver.get(f'https://{root_url}/robots.txt')
+
+        for c in cookies:
+            driver.add_cookie({'name': c['name'], 'value': c['value'],
+                               'domain': c['domain'], 'path': c['path'],
+                               'expiry': int(c['expires'])})
+
+    def record_session(self, session):
+        '''keep the consent cookies a consent form just set on `session`'''
+        # fetch workers keep setting cookies on the session; the jar's own
+        # lock holds them off while it is copied
+        with session.cookies._cookies_lock:
+            jar = list(session.cookies)
+
+        now = time.time()
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                    'expires': c.expires if c.expires is not None
+                    else now + SESSION_COOKIE_LIFETIME}
+                   for c in jar
+                   if c.name in CONSENT_COOKIES and c.domain.endswith(REDDIT_DOMAIN)]
+
+        # cookies the session does not hold (a replayed form sets none) are kept
+        with self.lock:
+            keys = {(c['name'], c['domain'], c['path']) for c in cookies}
+            self.cookies = [c for c in self.cookies
+                            if (c['name'], c['domain'], c['path']) not in keys] + cookies
+            self.save()
+
+    def is_quarantined(self, subreddit: str) -> bool:
+        with self.lock:
+            return self.quarantined.get(subreddit.lower(), False)
+
+    def set_quarantined(self, subreddit: str, quarantined: bool):
+        with self.lock:
+            if self.quarantined.get(subreddit.lower()) != quarantined:
+                self.quarantined[subreddit.lower()] = quarantined
+                self.save()
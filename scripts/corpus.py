@@ -0,0 +1,304 @@
+import collections
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+CORPUS_PATH = 'cache/corpus.sqlite'
+
+SCHEMA = '''
+create table if not exists snapshots (
+    date text primary key
+);
+
+create table if not exists titles (
+    title_id integer primary key,
+    title text not null unique,
+    tokens text not null,
+    words text not null
+);
+
+create table if not exists title_terms (
+    title_id integer not null,
+    term text not null,
+    count integer not null,
+    primary key (title_id, term)
+);
+
+-- the span of snapshots each submission was seen in; a submission that
+-- drops out and comes back gets a second row
+create table if not exists posts (
+    post_id text not null,
+    author text not null,
+    title_id integer not null,
+    first_seen text not null,
+    last_seen text not null,
+    live integer not null,
+    primary key (post_id, first_seen)
+);
+
+create index if not exists live_posts on posts (live, post_id);
+create index if not exists posts_by_span on posts (first_seen, last_seen);
+
+-- the latest snapshot's documents: each distinct (author, title) and the
+-- number of its live posts
+create table if not exists documents (
+    author text not null,
+    title_id integer not null,
+    posts integer not null,
+    primary key (author, title_id)
+);
+
+create table if not exists author_terms (
+    author text not null,
+    term text not null,
+    count integer not null,
+    primary key (author, term)
+);
+
+create table if not exists doc_freq (
+    term text primary key,
+    authors integer not null
+);
+'''
+
+TermCounts = collections.namedtuple('TermCounts', ['authors', 'vocabulary',
+                                                   'counts', 'doc_freq'])
+
+
+class Corpus:
+    '''author term counts kept up to date across daily snapshots
+
+    Submissions are keyed by post_id. Each update only tokenizes the titles
+    that have not been seen before, and only the documents that appeared or
+    dropped out since the previous snapshot change the per-author term
+    counts and the document frequencies. An author's titles are counted once
+    each, however many times they were posted, like the one-off analysis.
+
+    `tokenize_many(titles, workers)` returns flat (tokens, words, offsets)
+    arrays, as textual_analysis.tokenize_many does.
+    '''
+
+    def __init__(self, tokenize_many, path=CORPUS_PATH):
+        self.tokenize_many = tokenize_many
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def dates(self) -> list:
+        return [d for d, in self.connection.execute(
+            'select date from snapshots order by date')]
+
+    def update(self, date_str: str, submissions_df: pd.DataFrame, workers=1):
+        '''bring the corpus to the snapshot of `date_str`
+
+        `submissions_df` needs post_id, author and title columns. Snapshots
+        have to be added in date order; the latest one may be updated again.
+        New titles are tokenized by `workers` processes.
+        '''
+        dates = self.dates()
+        if dates and date_str < dates[-1]:
+            raise ValueError(f'the corpus is already at {dates[-1]}; '
+                             f'cannot go back to {date_str}')
+
+        prior = max([d for d in dates if d < date_str], default=None)
+
+        today = submissions_df[['post_id', 'author', 'title']].drop_duplicates('post_id')
+
+        with self.connection:
+            live = pd.read_sql('select post_id, author, title_id, first_seen '
+                               'from posts where live = 1', self.connection)
+
+            is_kept = live.post_id.isin(today.post_id)
+            kept, dropped = live[is_kept], live[~is_kept]
+            new = today[~today.post_id.isin(live.post_id)]
+            new = new.assign(title_id=self._title_ids(new.title, workers))
+
+            self.connection.executemany(
+                'update posts set last_seen = ? where post_id = ? and live = 1',
+                ((date_str, p) for p in kept.post_id))
+
+            self.connection.executemany(
+                'insert into posts values (?, ?, ?, ?, ?, 1)',
+                ((p, a, int(t), date_str, date_str)
+                 for p, a, t in new[['post_id', 'author', 'title_id']].itertuples(index=False)))
+
+            # a post only ever seen in a snapshot being redone never existed
+            never_seen = dropped.first_seen > (prior or '')
+            self.connection.executemany(
+                'delete from posts where post_id = ? and live = 1',
+                ((p,) for p in dropped.post_id[never_seen]))
+            self.connection.executemany(
+                'update posts set live = 0, last_seen = min(last_seen, ?) '
+                'where post_id = ? and live = 1',
+                ((prior, p) for p in dropped.post_id[~never_seen]))
+
+            delta = pd.concat([new[['author', 'title_id']].assign(posts=1),
+                               dropped[['author', 'title_id']].assign(posts=-1)])
+            delta = delta.groupby(['author', 'title_id'], as_index=False)['posts'].sum()
+            self._apply_documents(delta[delta.posts != 0])
+
+            self.connection.execute('insert or ignore into snapshots values (?)',
+                                    (date_str,))
+
+    def _title_ids(self, titles: pd.Series, workers=1) -> np.array:
+        unique_titles = titles.unique()
+        title_ids = self._lookup_titles(unique_titles)
+
+        unseen = [t for t in unique_titles if t not in title_ids]
+        if unseen:
+            tokens, words, offsets = self.tokenize_many(unseen, workers)
+
+            for i, title in enumerate(unseen):
+                title_tokens = list(tokens[offsets[i]:offsets[i + 1]])
+                title_words = list(words[offsets[i]:offsets[i + 1]])
+
+                cursor = self.connection.execute(
+                    'insert into titles (title, tokens, words) values (?, ?, ?)',
+                    (title, json.dumps(title_tokens), json.dumps(title_words)))
+                title_ids[title] = cursor.lastrowid
+
+                self.connection.executemany(
+                    'insert into title_terms values (?, ?, ?)',
+                    ((cursor.lastrowid, term, count) for term, count
+                     in collections.Counter(title_tokens).items()))
+
+        return titles.map(title_ids).to_numpy()
+
+    def _lookup_titles(self, titles) -> dict:
+        self.connection.execute('create temp table if not exists lookup (title text)')
+        self.connection.execute('delete from lookup')
+        self.connection.executemany('insert into lookup values (?)',
+                                    ((t,) for t in titles))
+
+        return dict(self.connection.execute(
+            'select titles.title, title_id from titles join lookup using (title)'))
+
+    def _execute_all(self, statements: str):
+        # executescript would commit the update halfway through
+        for statement in statements.split(';'):
+            if statement.strip():
+                self.connection.execute(statement)
+
+    def _apply_documents(self, delta: pd.DataFrame):
+        self._execute_all('''
+            create temp table if not exists document_delta (
+                author text, title_id integer, posts integer);
+            create temp table if not exists term_delta (
+                author text, term text, count integer);
+            delete from document_delta;
+            delete from term_delta;
+        ''')
+        self.connection.executemany(
+            'insert into document_delta values (?, ?, ?)',
+            ((a, int(t), int(p)) for a, t, p in delta.itertuples(index=False)))
+
+        # documents that appear (+1) or disappear (-1) change the term counts
+        self.connection.execute('''
+            insert into term_delta
+            select d.author, tt.term, sum(tt.count * sign)
+            from (select dd.author, dd.title_id,
+                         case when coalesce(doc.posts, 0) = 0 then 1 else -1 end as sign
+                  from document_delta dd
+                  left join documents doc using (author, title_id)
+                  where (coalesce(doc.posts, 0) = 0) != (coalesce(doc.posts, 0) + dd.posts = 0)) d
+            join title_terms tt using (title_id)
+            group by d.author, tt.term
+        ''')
+
+        self._execute_all('''
+            insert into documents (author, title_id, posts)
+            select author, title_id, posts from document_delta where true
+            on conflict (author, title_id) do update set posts = posts + excluded.posts;
+            delete from documents where posts <= 0;
+
+            -- terms an author starts (+1) or stops (-1) using change their frequency
+            insert into doc_freq (term, authors)
+            select td.term, sum(case when coalesce(at.count, 0) = 0 then 1 else -1 end)
+            from term_delta td
+            left join author_terms at using (author, term)
+            where (coalesce(at.count, 0) = 0) != (coalesce(at.count, 0) + td.count = 0)
+            group by td.term
+            on conflict (term) do update set authors = authors + excluded.authors;
+            delete from doc_freq where authors <= 0;
+
+            insert into author_terms (author, term, count)
+            select author, term, count from term_delta where true
+            on conflict (author, term) do update set count = count + excluded.count;
+            delete from author_terms where count <= 0;
+        ''')
+
+    def title_tokens(self, titles: pd.Series) -> tuple:
+        '''flat (tokens, words, offsets) for `titles`, as tokenize_many gives'''
+        stored = dict()
+        with self.connection:
+            self._lookup_titles(titles.unique())
+            for title, tokens, words in self.connection.execute(
+                    'select titles.title, tokens, words from titles join lookup using (title)'):
+                stored[title] = (json.loads(tokens), json.loads(words))
+
+        if len(stored) < titles.nunique():
+            return self.tokenize_many(titles)
+
+        title_tokens = [stored[t] for t in titles]
+        offsets = np.concatenate([[0], np.cumsum([len(t) for t, _ in title_tokens])])
+
+        tokens = np.array([n for t, _ in title_tokens for n in t], dtype=object)
+        words = np.array([n for _, w in title_tokens for n in w], dtype=object)
+
+        return tokens, words, offsets
+
+    def term_counts(self, start_str=None, end_str=None) -> TermCounts:
+        '''author x term counts, for the latest snapshot or a date window
+
+        Without dates the maintained counts of the latest snapshot are read
+        as they are. With them, every title posted in a snapshot between
+        `start_str` and `end_str` (inclusive) counts once per author.
+        '''
+        if start_str is None and end_str is None:
+            authors = [a for a, in self.connection.execute(
+                'select distinct author from documents order by author')]
+            doc_freq = pd.read_sql('select term, authors from doc_freq order by term',
+                                   self.connection)
+            entries = pd.read_sql('select author, term, count from author_terms',
+                                  self.connection)
+        else:
+            self.connection.execute('drop table if exists temp.window_documents')
+            self.connection.execute('''
+                create temp table window_documents as
+                select distinct author, title_id from posts
+                where first_seen <= ? and last_seen >= ?
+            ''', (end_str or '99999999', start_str or ''))
+
+            authors = [a for a, in self.connection.execute(
+                'select distinct author from window_documents order by author')]
+            entries = pd.read_sql('''
+                select author, term, sum(count) as count
+                from window_documents join title_terms using (title_id)
+                group by author, term
+            ''', self.connection)
+            doc_freq = (entries.groupby('term', as_index=False)['author'].count()
+                        .rename({'author': 'authors'}, axis=1).sort_values('term'))
+
+        authors = np.array(authors, dtype=object)
+        vocabulary = doc_freq.term.to_numpy(dtype=object)
+
+        counts = sparse.csr_matrix(
+            (entries['count'].to_numpy(dtype=np.int64),
+             (np.searchsorted(authors, entries.author.to_numpy(dtype=object)),
+              np.searchsorted(vocabulary, entries.term.to_numpy(dtype=object)))),
+            shape=(len(authors), len(vocabulary)))
+        counts.sort_indices()
+
+        return TermCounts(authors, vocabulary, counts, doc_freq.authors.to_numpy())
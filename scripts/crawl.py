@@ -0,0 +1,207 @@
+import collections
+import json
+import os
+import shutil
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from atomic import write_json
+
+
+CHECKPOINT_DIR = 'cache/crawl'
+
+# subreddits scraped at the same time; they share the run's fetch workers
+MAX_CONCURRENT = 4
+
+
+class Crawler:
+    '''breadth-first crawl outward from a subreddit through its authors
+
+    Layer 0 is the root subreddit; every subreddit an author of layer n has
+    posted to joins layer n + 1, up to `depth`. Subreddits and authors are
+    only ever scraped once per crawl, `depth_limits` optionally caps how many
+    subreddits each layer may hold, and up to `max_concurrent` subreddits of
+    the frontier are scraped at a time, the next one starting as soon as any
+    of them is done.
+
+    Records go to `sink` as they are scraped, author by author. The crawl is
+    checkpointed whenever the sink writes a part and after each subreddit,
+    right after the sink is flushed, together with the authors and the
+    subreddit posts already written. An interrupted crawl then picks up
+    where it stopped when it is run again into the same snapshot, scraping
+    only the authors it had not written yet.
+    '''
+
+    def __init__(self, scrape_subreddit, subreddit: str, sink, depth=1,
+                 depth_limits=None, max_concurrent=MAX_CONCURRENT,
+                 exclude_authors=set(), checkpoint_dir=CHECKPOINT_DIR,
+                 **scrape_kwargs):
+        self.scrape_subreddit = scrape_subreddit
+        self.sink = sink
+        self.scrape_kwargs = scrape_kwargs
+        self.max_concurrent = max_concurrent
+        self.depth_limits = depth_limits or dict()
+
+        # subreddits scraped side by side write to the sink from their own
+        # threads
+        self.lock = threading.RLock()
+
+        self.directory = os.path.join(checkpoint_dir, subreddit)
+        self.checkpoint_path = os.path.join(self.directory, 'checkpoint.json')
+
+        self.crawl_id = {'subreddit': subreddit,
+                         'depth': depth,
+                         'snapshot': sink.directory}
+
+        if not self._resume():
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            self.sink.reset()
+
+            self.frontier = collections.deque([(subreddit, 0)])
+            self.visited_subreddits = {subreddit}
+            self.visited_authors = set(exclude_authors)
+            self.posts_written = set()
+            self.layer_sizes = collections.Counter({0: 1})
+
+            self._checkpoint()
+
+    def _resume(self) -> bool:
+        try:
+            with open(self.checkpoint_path, encoding='utf8') as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return False
+
+        if checkpoint['crawl_id'] != self.crawl_id or not checkpoint['frontier']:
+            return False
+
+        self.frontier = collections.deque(tuple(n) for n in checkpoint['frontier'])
+        self.visited_subreddits = set(checkpoint['visited_subreddits'])
+        self.visited_authors = set(checkpoint['visited_authors'])
+        self.posts_written = set(checkpoint.get('posts_written', []))
+        self.layer_sizes = collections.Counter({int(k): v for k, v
+                                                in checkpoint['layer_sizes'].items()})
+
+        # drop anything written after the last checkpoint; those subreddits
+        # are still in the frontier and will be scraped again
+        self.sink.truncate(checkpoint['part_counts'])
+
+        return True
+
+    def _checkpoint(self):
+        with self.lock:
+            self.sink.flush()
+
+            checkpoint = {'crawl_id': self.crawl_id,
+                          'frontier': list(self.frontier),
+                          'visited_subreddits': sorted(self.visited_subreddits),
+                          'visited_authors': sorted(self.visited_authors),
+                          'posts_written': sorted(self.posts_written),
+                          'layer_sizes': self.layer_sizes,
+                          'part_counts': self.sink.part_counts()}
+
+            write_json(self.checkpoint_path, checkpoint)
+
+    def _scrape(self, subreddit: str, layer: int):
+        with self.lock:
+            exclude_authors = set(self.visited_authors)
+
+        self.scrape_subreddit(subreddit, exclude_authors,
+                              sink=SubredditWriter(self, subreddit, layer),
+                              **self.scrape_kwargs)
+
+    def _enqueue(self, subreddit: str, layer: int):
+        if subreddit in self.visited_subreddits:
+            return
+
+        limit = self.depth_limits.get(layer)
+        if limit is not None and self.layer_sizes[layer] >= limit:
+            return
+
+        self.visited_subreddits.add(subreddit)
+        self.layer_sizes[layer] += 1
+        self.frontier.append((subreddit, layer))
+
+    def write_posts(self, subreddit: str, post_records: list):
+        with self.lock:
+            # a resumed subreddit's posts are already in the sink
+            if subreddit in self.posts_written:
+                return
+
+            self.posts_written.add(subreddit)
+            if self.sink.write('posts', post_records):
+                self._checkpoint()
+
+    def write_author(self, layer: int, author: dict, author_posts: list):
+        with self.lock:
+            # subreddits scraped side by side can share authors; keep whichever
+            # was written first
+            if author['username'] in self.visited_authors:
+                return
+
+            self.visited_authors.add(author['username'])
+
+            if layer < self.crawl_id['depth']:
+                for post in author_posts:
+                    self._enqueue(post['subreddit'], layer + 1)
+
+            if self.sink.write_author(author, author_posts):
+                self._checkpoint()
+
+    def run(self):
+        # subreddits stay in the frontier until they are done, so a resumed
+        # crawl scrapes the ones that were running again
+        running = dict()
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            while True:
+                if error is None:
+                    with self.lock:
+                        started = set(running.values())
+                        waiting = [n for n in self.frontier if n not in started]
+
+                    for node in waiting[:self.max_concurrent - len(running)]:
+                        running[executor.submit(self._scrape, *node)] = node
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # let the running subreddits finish, start no others
+                        error = error or e
+                        continue
+
+                    with self.lock:
+                        self.frontier.remove(node)
+                        self._checkpoint()
+
+        if error is not None:
+            raise error
+
+
+class SubredditWriter:
+    '''the sink one subreddit's scrape writes to, through its crawler'''
+
+    def __init__(self, crawler: Crawler, subreddit: str, layer: int):
+        self.crawler = crawler
+        self.subreddit = subreddit
+        self.layer = layer
+
+    def write(self, name: str, records: list) -> bool:
+        if name != 'posts':
+            raise ValueError(f'{name} records are written with write_author')
+
+        self.crawler.write_posts(self.subreddit, records)
+        return False
+
+    def write_author(self, author: dict, author_posts: list) -> bool:
+        self.crawler.write_author(self.layer, author, author_posts)
+        return False
@@ -0,0 +1,133 @@
+import requests
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from metrics import Metrics
+from rate_limit import RateLimiter, MAX_RETRIES, backoff_delay, parse_retry_after
+from response_cache import ReplayMiss
+
+
+# use a standard browser agent to circumvent reddit blocking the requests
+MOZILLA_USER_AGENT = {'User-Agent': 'Mozilla/5.0'}
+
+MAX_WORKERS = 8
+
+# seconds to wait for a connection, and then for each read, before the
+# attempt counts as failed; without it a stalled connection hangs its worker
+TIMEOUT = 30
+
+# responses worth retrying: rate limited, or reddit being briefly unwell
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class Fetcher:
+
+    def __init__(self, max_workers=MAX_WORKERS, response_cache=None,
+                 rate_limiter=None, metrics=None):
+        self.max_workers = max_workers
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+
+        # one keep-alive pool per host, sized so that every worker thread can
+        # hold a connection without blocking on the others
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers)
+
+        self.session = requests.Session()
+        self.session.headers.update(MOZILLA_USER_AGENT)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        kwargs.setdefault('timeout', TIMEOUT)
+
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES:
+                    self.metrics.request(time.perf_counter() - start, 0, attempt, 'error')
+                    raise
+
+                self.rate_limiter.fail()
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                self.rate_limiter.succeed()
+                self.metrics.request(time.perf_counter() - start, len(response.content),
+                                     attempt, response.status_code)
+                return response
+
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            self.rate_limiter.fail(retry_after)
+
+            if attempt < MAX_RETRIES:
+                time.sleep(backoff_delay(attempt, retry_after))
+
+        self.metrics.request(time.perf_counter() - start, len(response.content),
+                             MAX_RETRIES, response.status_code)
+        response.raise_for_status()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        cache = self.response_cache
+        if cache is None:
+            return self.send(method, url, **kwargs)
+
+        key = cache.key(method, url, kwargs.get('params'), kwargs.get('data'))
+        entry = cache.lookup(key)
+
+        if cache.replay:
+            if entry is None:
+                raise ReplayMiss(f'{method} {url} is not in the response cache')
+            self.metrics.cached_response()
+            return cache.load(entry)
+
+        # form posts always go to the server, so their cookies reach the
+        # session; they are only stored to be replayed
+        is_get = method.upper() == 'GET'
+
+        if is_get and entry is not None and cache.is_fresh(entry):
+            self.metrics.cached_response()
+            return cache.load(entry)
+
+        # only GETs are revalidated
+        if is_get:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.update(cache.conditional_headers(entry))
+            kwargs['headers'] = headers
+
+        response = self.send(method, url, **kwargs)
+
+        if is_get and response.status_code == 304 and entry is not None:
+            cache.touch(key, entry)
+            self.metrics.cached_response()
+            return cache.load(entry)
+
+        cache.store(key, response)
+
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def map(self, func, *iterables):
+        return self.executor.map(func, *iterables)
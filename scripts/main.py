@@ -1,8 +1,130 @@
-import textual_analysis
-import report
+import argparse
+import pprint as pp
+
+# run from the repository root:
+#   python scripts/main.py scrape   - download today's snapshot
+#   python scripts/main.py analyze  - build author_terms.json/title_terms.csv
+#   python scripts/main.py report   - build the Markdown reports
+#   python scripts/main.py trends   - week by week totals across snapshots
+#   python scripts/main.py whois DOMAIN ...
+#
+# with no command, analyze and report are run in turn, each only when its
+# inputs or code changed since it last ran (--force runs them anyway). Every
+# stage imports its own dependencies, so a command only pays for the modules
+# it uses.
+#
+# every run writes its stage timings, row counts and request statistics to
+# cache/metrics (or --metrics PATH; a .prom path gets the Prometheus text
+# format). --trace-memory adds each stage's peak memory and --profile DIR
+# dumps a cProfile of each stage into DIR.
+
+
+def run_scrape(args):
+    import scrape
+
+    scrape_kwargs = dict()
+    if args.workers is not None:
+        scrape_kwargs['max_workers'] = args.workers
+
+    with args.metrics.stage('scrape'):
+        scrape.main(args.subreddit, args.depth, args.replay,
+                    use_browser=args.browser, metrics=args.metrics, **scrape_kwargs)
+
+
+def run_analyze(args):
+    import textual_analysis
+
+    with args.metrics.stage('analyze'):
+        textual_analysis.term_freq_by_inverse_document_freq(args.processes, args.metrics)
+
+
+def run_report(args):
+    import report
+
+    with args.metrics.stage('report'):
+        report.build(args.metrics)
+
+
+def run_trends(args):
+    import trends
+
+    with args.metrics.stage('trends'):
+        trends.main(args.weeks)
+
+
+def run_whois(args):
+    from whois import whois
+
+    for domain in args.domains:
+        pp.pprint(whois(domain))
+
+
+def run_all(args):
+    import pipeline
+
+    pipeline.main(args.processes, args.force, args.metrics)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='main.py')
+    parser.set_defaults(command=run_all)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='tokenize titles in this many processes')
+    parser.add_argument('--force', action='store_true',
+                        help='run every stage, even those that are up to date')
+    parser.add_argument('--metrics', dest='metrics_path', metavar='PATH',
+                        help='write the run\'s metrics here (.json or .prom)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record each stage\'s peak memory with tracemalloc')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='dump a cProfile of each stage into DIR')
+    commands = parser.add_subparsers(title='commands')
+
+    scrape_parser = commands.add_parser('scrape', help='download today\'s snapshot')
+    scrape_parser.add_argument('--subreddit', default='propaganda')
+    scrape_parser.add_argument('--depth', type=int, default=0,
+                               help='crawl subreddits this many hops out')
+    scrape_parser.add_argument('--workers', type=int,
+                               help='concurrent requests per subreddit')
+    scrape_parser.add_argument('--browser', action='store_true',
+                               help='scrape profiles with Firefox')
+    scrape_parser.add_argument('--replay', action='store_true',
+                               help='serve every page from the response cache')
+    scrape_parser.set_defaults(command=run_scrape)
+
+    analyze_parser = commands.add_parser('analyze', help='compute author terms')
+    # also accepted after the command; left unset there so it does not
+    # override the one given before it
+    analyze_parser.add_argument('--processes', type=int, default=argparse.SUPPRESS,
+                                help='tokenize titles in this many processes')
+    analyze_parser.set_defaults(command=run_analyze)
+
+    report_parser = commands.add_parser('report', help='build the Markdown reports')
+    report_parser.set_defaults(command=run_report)
+
+    trends_parser = commands.add_parser('trends', help='compare the weekly snapshots')
+    trends_parser.add_argument('--weeks', type=int, default=4)
+    trends_parser.set_defaults(command=run_trends)
+
+    whois_parser = commands.add_parser('whois', help='look up domain registrations')
+    whois_parser.add_argument('domains', nargs='+')
+    whois_parser.set_defaults(command=run_whois)
+
+    return parser
+
+
+def main(argv=None):
+    from metrics import Metrics
+
+    args = build_parser().parse_args(argv)
+    args.metrics = Metrics(args.trace_memory, args.profile)
+
+    try:
+        args.command(args)
+    finally:
+        command = args.command.__name__.replace('run_', '')
+        args.metrics.write(args.metrics_path or args.metrics.default_path(command))
 
-# run scrape.py first
 
 if __name__ == '__main__':
-    textual_analysis.term_freq_by_inverse_document_freq()
-    report.build()
+    main()
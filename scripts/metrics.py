@@ -0,0 +1,200 @@
+import bisect
+import contextlib
+import datetime as dt
+import json
+import math
+import os
+import threading
+import time
+
+from atomic import atomic_open
+
+
+METRICS_DIR = 'cache/metrics'
+
+# upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        '''(upper bound, observations at or below it) pairs, as Prometheus has them'''
+        total = 0
+        cumulative = list()
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return cumulative
+
+
+class Metrics:
+    '''timings, memory, row counts and request statistics of one run
+
+    `stage(name)` times a block in wall-clock and CPU seconds. CPU time is the
+    whole process's, so stages running at the same time share theirs, as they
+    do the tracemalloc peak. Peak memory is only traced with `trace_memory`,
+    since tracemalloc slows every allocation down, and with `profile_dir` set
+    each stage also dumps a cProfile of the thread that ran it there.
+
+    `write(path)` saves everything as JSON, or in the Prometheus text format
+    when the path ends in .prom.
+    '''
+
+    def __init__(self, trace_memory=False, profile_dir=None):
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+
+        self.started = dt.datetime.now()
+        self.stages = dict()
+        self.requests = Histogram()
+        self.request_counts = dict()
+        self.response_bytes = 0
+        self.retries = 0
+        self.cached_responses = 0
+
+        self.lock = threading.Lock()
+
+    def _stage(self, name: str) -> dict:
+        return self.stages.setdefault(name, {'wall_seconds': 0.0,
+                                             'cpu_seconds': 0.0,
+                                             'peak_memory_bytes': None,
+                                             'rows': dict(),
+                                             'skipped': False})
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        profiler = None
+        if self.profile_dir is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+
+        if self.trace_memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+
+        try:
+            yield self
+        finally:
+            if profiler is not None:
+                profiler.disable()
+
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+
+            with self.lock:
+                stage = self._stage(name)
+                stage['wall_seconds'] += wall_seconds
+                stage['cpu_seconds'] += cpu_seconds
+                if peak is not None:
+                    stage['peak_memory_bytes'] = max(stage['peak_memory_bytes'] or 0, peak)
+
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+
+    def skipped(self, name: str):
+        with self.lock:
+            self._stage(name)['skipped'] = True
+
+    def rows(self, stage: str, table: str, count: int):
+        with self.lock:
+            rows = self._stage(stage)['rows']
+            rows[table] = rows.get(table, 0) + int(count)
+
+    def request(self, seconds: float, size: int, retries: int, status):
+        '''one request sent to the server, from its first attempt to its last'''
+        with self.lock:
+            self.requests.observe(seconds)
+            self.request_counts[str(status)] = self.request_counts.get(str(status), 0) + 1
+            self.response_bytes += size
+            self.retries += retries
+
+    def cached_response(self):
+        with self.lock:
+            self.cached_responses += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'started': self.started.isoformat(timespec='seconds'),
+                    'stages': {n: dict(s, rows=dict(s['rows'])) for n, s in self.stages.items()},
+                    'requests': {'count': self.requests.count,
+                                 'seconds': self.requests.sum,
+                                 'latency_buckets': {'+Inf' if b == math.inf else str(b): c
+                                                     for b, c in self.requests.cumulative()},
+                                 'by_status': dict(self.request_counts),
+                                 'bytes': self.response_bytes,
+                                 'retries': self.retries,
+                                 'cached': self.cached_responses}}
+
+    def to_prometheus(self) -> str:
+        metrics = self.to_dict()
+        lines = list()
+
+        def family(name: str, kind: str, samples: list):
+            if samples:
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(samples)
+
+        stages = metrics['stages']
+        for key in ('wall_seconds', 'cpu_seconds', 'peak_memory_bytes'):
+            family(f'stage_{key}', 'gauge',
+                   [f'stage_{key}{{stage="{n}"}} {s[key]}'
+                    for n, s in stages.items() if s[key] is not None])
+
+        family('stage_skipped', 'gauge',
+               [f'stage_skipped{{stage="{n}"}} {int(s["skipped"])}' for n, s in stages.items()])
+        family('stage_rows', 'gauge',
+               [f'stage_rows{{stage="{n}",table="{t}"}} {c}'
+                for n, s in stages.items() for t, c in s['rows'].items()])
+
+        requests = metrics['requests']
+        if requests['count'] or requests['cached']:
+            family('http_request_duration_seconds', 'histogram',
+                   [f'http_request_duration_seconds_bucket{{le="{b}"}} {c}'
+                    for b, c in requests['latency_buckets'].items()]
+                   + [f'http_request_duration_seconds_sum {requests["seconds"]}',
+                      f'http_request_duration_seconds_count {requests["count"]}'])
+            family('http_requests_total', 'counter',
+                   [f'http_requests_total{{status="{s}"}} {c}'
+                    for s, c in requests['by_status'].items()])
+            family('http_response_bytes_total', 'counter',
+                   [f'http_response_bytes_total {requests["bytes"]}'])
+            family('http_request_retries_total', 'counter',
+                   [f'http_request_retries_total {requests["retries"]}'])
+            family('http_cached_responses_total', 'counter',
+                   [f'http_cached_responses_total {requests["cached"]}'])
+
+        return '\n'.join(lines) + '\n'
+
+    def default_path(self, command: str) -> str:
+        return os.path.join(METRICS_DIR, f'{self.started:%Y%m%d_%H%M%S}_{command}.json')
+
+    def write(self, path: str):
+        with atomic_open(path, 'w', encoding='utf8') as file:
+            if path.endswith('.prom'):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), file, indent=1)
@@ -0,0 +1,200 @@
+import collections
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import snapshot
+
+from atomic import write_json
+from catalog import Catalog, file_hash
+from metrics import Metrics
+
+
+PIPELINE_STATE_PATH = 'cache/pipeline.json'
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# `inputs(date_str)` and `outputs(date_str)` list the files a stage reads and
+# writes; `code` the modules whose changes make it run again; `after` the
+# stages that have to finish first
+Stage = collections.namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'code', 'after'])
+
+
+def snapshot_files(date_str: str, tables: tuple, subreddit=snapshot.SUBREDDIT,
+                   data_dir=snapshot.DATA_DIR) -> list:
+    '''every copy of the snapshot tables found for a date, in any format'''
+    paths = list()
+    for table in tables:
+        for extension in ('parquet', 'csv', 'json'):
+            path = snapshot.snapshot_path(date_str, table, extension, subreddit, data_dir)
+            if os.path.exists(path):
+                paths.append(path)
+
+    return paths
+
+
+class Pipeline:
+    '''runs stages whose inputs, outputs or code changed since their last run
+
+    A stage's fingerprint is the sha256 of its input files and code. It is
+    skipped when the fingerprint matches the one recorded in
+    cache/pipeline.json for the same date and its outputs still hash to what
+    it wrote then. Stages run as soon as the stages they come after are done,
+    so independent stages run at the same time.
+    '''
+
+    def __init__(self, stages: list, date_str: str, path=PIPELINE_STATE_PATH, force=False,
+                 metrics=None):
+        self.stages = {s.name: s for s in stages}
+        self.date_str = date_str
+        self.path = path
+        self.force = force
+        self.metrics = metrics or Metrics()
+
+        for stage in stages:
+            unknown = set(stage.after) - set(self.stages)
+            if unknown:
+                raise ValueError(f'{stage.name} comes after unknown stages {sorted(unknown)}')
+
+        try:
+            with open(path, encoding='utf8') as file:
+                self.state = json.load(file)
+        except FileNotFoundError:
+            self.state = dict()
+
+        self.lock = threading.Lock()
+
+    def save(self):
+        write_json(self.path, self.state, indent=1, sort_keys=True)
+
+    def fingerprint(self, stage: Stage) -> str:
+        sha256 = hashlib.sha256()
+
+        inputs = sorted(stage.inputs(self.date_str))
+        code = sorted(os.path.join(SCRIPTS_DIR, f'{m}.py') for m in stage.code)
+
+        for path in inputs + code:
+            digest = file_hash(path) if os.path.exists(path) else None
+            sha256.update(f'{path}:{digest};'.encode())
+
+        return sha256.hexdigest()
+
+    @staticmethod
+    def output_hashes(stage: Stage, date_str: str) -> dict:
+        return {path: file_hash(path) if os.path.exists(path) else None
+                for path in stage.outputs(date_str)}
+
+    def is_up_to_date(self, stage: Stage, fingerprint: str) -> bool:
+        with self.lock:
+            previous = self.state.get(stage.name, {}).get(self.date_str)
+
+        return (previous is not None
+                and previous['fingerprint'] == fingerprint
+                and previous['outputs'] == self.output_hashes(stage, self.date_str))
+
+    def _run_stage(self, stage: Stage) -> bool:
+        fingerprint = self.fingerprint(stage)
+        if not self.force and self.is_up_to_date(stage, fingerprint):
+            print(f'{stage.name}: up to date')
+            self.metrics.skipped(stage.name)
+            return False
+
+        print(f'{stage.name}: running')
+        with self.metrics.stage(stage.name):
+            stage.run()
+
+        outputs = self.output_hashes(stage, self.date_str)
+        with self.lock:
+            self.state.setdefault(stage.name, {})[self.date_str] = {
+                'fingerprint': fingerprint,
+                'outputs': outputs}
+            self.save()
+
+        return True
+
+    def run(self, max_workers=None) -> dict:
+        '''run every stage that is out of date; returns which ones ran'''
+        ran = dict()
+        pending = dict(self.stages)
+        running = dict()
+        error = None
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.stages)) as executor:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(a in ran for a in stage.after):
+                            running[executor.submit(self._run_stage, stage)] = name
+                            del pending[name]
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        ran[name] = future.result()
+                    except Exception as e:
+                        # let the running stages finish, start no others
+                        error = error or e
+
+        if error is not None:
+            raise error
+
+        return ran
+
+
+def default_stages(processes=1, metrics=None) -> list:
+    '''the daily analysis and reports'''
+    def run_analyze():
+        import textual_analysis
+
+        textual_analysis.term_freq_by_inverse_document_freq(processes, metrics)
+
+    def run_report():
+        import report
+
+        report.build(metrics)
+
+    def report_inputs(date_str: str) -> list:
+        import report
+
+        last_week_str = Catalog.load().latest_before(date_str, report.LOOKBACK_DAYS,
+                                                     tables=('posts', 'authors'))
+
+        inputs = snapshot_files(date_str, ('posts', 'authors', 'author_submissions'))
+        inputs.append(os.path.join(snapshot.DATA_DIR, date_str, 'author_top_terms.parquet'))
+        if last_week_str is not None:
+            inputs += snapshot_files(last_week_str, ('posts', 'authors'))
+
+        return inputs
+
+    def data_files(*names):
+        return lambda date_str: [os.path.join(snapshot.DATA_DIR, date_str, n) for n in names]
+
+    return [Stage('analyze', run_analyze,
+                  inputs=lambda date_str: snapshot_files(date_str, ('author_submissions',)),
+                  outputs=data_files('author_terms.json', 'title_terms.csv',
+                                     'author_top_terms.parquet'),
+                  code=('textual_analysis', 'corpus', 'stem_cache', 'snapshot'),
+                  after=()),
+            Stage('report', run_report,
+                  inputs=report_inputs,
+                  outputs=data_files('propaganda_posts.md', 'propaganda_users.md'),
+                  code=('report', 'snapshot', 'catalog'),
+                  after=('analyze',))]
+
+
+def main(processes=1, force=False, metrics=None):
+    today_str = dt.date.today().strftime('%Y%m%d')
+
+    Pipeline(default_stages(processes, metrics), today_str, force=force,
+             metrics=metrics).run()
+
+
+if __name__ == '__main__':
+    main()
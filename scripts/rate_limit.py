@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+
+# requests per second; old.reddit starts answering 429 somewhere above 1/s
+# for anonymous clients, so the limiter starts there and probes upwards
+RATE = 1.0
+MIN_RATE = 0.1
+MAX_RATE = 4.0
+
+# requests that may go out back to back after an idle period
+BURST = 4
+
+# additive increase per success, multiplicative decrease per failure
+RATE_INCREASE = 0.02
+RATE_DECREASE = 0.5
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+def backoff_delay(attempt: int, retry_after=None) -> float:
+    '''full-jitter exponential backoff, never shorter than `retry_after`'''
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    return delay if retry_after is None else max(delay, retry_after)
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # reddit only sends seconds; an HTTP date is treated as absent
+        return None
+
+
+class RateLimiter:
+    '''token bucket shared by every request a scrape makes
+
+    The refill rate adapts to the server: each success nudges it up, each
+    429/5xx halves it, and a Retry-After pauses the bucket outright.
+    '''
+
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - max(self.updated_at, self.paused_until))
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = max(now, self.updated_at)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def succeed(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def fail(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+
+            if retry_after is not None:
+                now = time.monotonic()
+                self._refill(now)
+                self.tokens = 0
+                self.paused_until = max(self.paused_until, now + retry_after)
@@ -3,166 +3,127 @@ import pandas as pd
 import pprint as pp
 import datetime as dt
 
-from scrape import SubredditScraper
-from textual_analysis import tokenize
-from whois import whois
+import snapshot
+
+from catalog import Catalog
+from metrics import Metrics
 
 
 BUZZWORD_THRESHOLD = 5
 
+# the report compares against the latest snapshot at least this many days old
+LOOKBACK_DAYS = 7
+
 today = dt.date.today()
 today_str = today.strftime('%Y%m%d')
 
-lookback = 7
-while lookback < 100000:
-    try:
-        last_week_str = (today - dt.timedelta(days=lookback)).strftime('%Y%m%d')
-        open(f'data/{last_week_str}/propaganda_author_submissions.csv').close()
-    except FileNotFoundError:
-        lookback += 1
-    else:
-        break
-
-
-def fill_nan(df, series, value):
-    for row in df.loc[df[series].isnull(), series].index:
-        df.at[row, series] = value
-
-    return df
-
 
 def process_crossposts(sub_df: pd.DataFrame, submissions_df: pd.DataFrame, user_df: pd.DataFrame):
-    post_records = list()
-
-    for author in sub_df.author.unique():
-        propaganda_posts = sub_df[sub_df.author == author]
-        other_posts = submissions_df[submissions_df.author == author]
-        other_posts = other_posts[other_posts.subreddit != 'propaganda']
-        other_posts = pd.DataFrame(other_posts)
-
-        is_crosspost = propaganda_posts.link.isin(other_posts.link.unique())
-
-        crossposts = pd.DataFrame(propaganda_posts[is_crosspost])
-
-        crosspost_records = list()
-
-        for _, post in crossposts.iterrows():
-            other_versions = pd.DataFrame(other_posts[other_posts.link == post.link])
-            crosspost_records.append((post.post_id, other_versions.to_dict(orient='records')))
+    other_posts = submissions_df[submissions_df.subreddit != 'propaganda']
 
-        crossposts = pd.DataFrame(crosspost_records, columns=('post_id', 'other_versions'))
-        crossposts = crossposts.set_index('post_id')
+    # every other version of a link, indexed by who posted it and where to
+    other_versions = other_posts.assign(other_versions=other_posts.to_dict(orient='records'))
+    other_versions = other_versions.groupby(['author', 'link'], sort=False)['other_versions'].agg(list)
 
-        propaganda_posts = propaganda_posts.join(crossposts, on='post_id', how='left')
-        propaganda_posts = fill_nan(propaganda_posts, 'other_versions', [])
+    propaganda_posts = sub_df.join(other_versions, on=['author', 'link'], how='left')
+    propaganda_posts['other_versions'] = [n if isinstance(n, list) else []
+                                          for n in propaganda_posts.other_versions]
 
-        propaganda_posts = propaganda_posts.join(user_df, on='author', how='left')
+    propaganda_posts = propaganda_posts.join(user_df, on='author', how='left')
 
-        posts_json_records = propaganda_posts.to_dict(orient='records')
+    # posts are listed author by author, in the order the authors first appear
+    author_order = pd.factorize(propaganda_posts.author)[0]
+    propaganda_posts = propaganda_posts.iloc[np.argsort(author_order, kind='stable')]
 
-        post_records += posts_json_records
-
-    return post_records
+    return propaganda_posts.to_dict(orient='records')
 
 
 def process_buzzwords(records):
-    terms_df = pd.read_json(f'data/{today_str}/author_terms.json')
-
-    terms_df = terms_df.explode('terms')
-    terms_df['term'] = terms_df['terms'].apply(lambda n: n['term'])
-    terms_df['tf_idf'] = terms_df['terms'].apply(lambda n: n['tf_idf'])
-    terms_df['count'] = terms_df['terms'].apply(lambda n: n['count'])
-
-    rank_kwargs = {'method': 'dense', 'ascending': False}
-    terms_df['rank'] = terms_df.groupby('author')['tf_idf'].rank(**rank_kwargs)
+    # each author's best terms, ranked and stemmed by the analysis
+    terms_df = pd.read_parquet(f'data/{today_str}/author_top_terms.parquet',
+                               columns=['author', 'rank', 'token', 'term'])
 
-    terms_df = terms_df.drop('terms', axis=1)
+    terms_df['term'] = terms_df['term'].str.lower()
+    terms_df = terms_df.drop_duplicates()
 
-    terms_df['token'] = terms_df['term'].apply(lambda n: tokenize(n)[0][0])
-    terms_df = terms_df.groupby(['author', 'token', 'tf_idf', 'rank'])['term'].agg(list).reset_index()
-
-    terms_df['term'] = terms_df['term'].apply(np.vectorize(str.lower)).apply(set).apply('/'.join)
-
-    terms_df = terms_df.groupby(['author', 'rank'])['term'].agg(list).reset_index()
+    # words sharing a stem are shown together, e.g. fact/facts
+    terms_df = terms_df.groupby(['author', 'rank', 'token'], sort=False)['term'].agg('/'.join)
+    terms_df = terms_df.reset_index()
 
     # filter out ranks with more than 10 words; such a large group would
     # indicate that the author does not have enough posts from which to derive
     # a meaningful pattern
-    terms_df = terms_df[BUZZWORD_THRESHOLD + 1 > terms_df.term.apply(len)]
-
-    terms_df['term'] = terms_df['term'].apply(', '.join)
+    rank_sizes = terms_df.groupby(['author', 'rank'])['token'].transform('size')
+    terms_df = terms_df[BUZZWORD_THRESHOLD + 1 > rank_sizes]
 
-    terms_df = terms_df.sort_values(['author', 'rank'])
+    terms_df = terms_df.groupby(['author', 'rank'], sort=False)['term'].agg(', '.join)
+    terms_df = terms_df.reset_index()
 
-    terms_df['term'] = terms_df.apply(lambda n: f'({int(n["rank"])}) {n["term"]}', axis=1)
+    terms_df['term'] = '(' + terms_df['rank'].astype(str) + ') ' + terms_df['term']
 
-    term = terms_df.groupby('author')['term'].agg(' '.join)
+    term = terms_df.groupby('author', sort=False)['term'].agg(' '.join)
 
     records = list(map(lambda n: dict(n, buzzwords=term.get(n['author'])), records))
 
     return records
 
 
-def prepare_data(records: list) -> list:
-    processed_records = list()
-    for record in records:
+def prepare_data(records: list) -> pd.DataFrame:
+    posts_df = pd.DataFrame(records)
 
-        # x-post subreddits
-        other_subreddits = ', '.join({'/r/' + v['subreddit']
-                                      for v in record['other_versions']})
-        record['other_subreddits'] = other_subreddits
+    # x-post subreddits, in the order their posts were found
+    other_versions = posts_df['other_versions'].explode().dropna()
+    other_subreddits = '/r/' + other_versions.str.get('subreddit')
+    other_subreddits = other_subreddits.reset_index().drop_duplicates()
+    other_subreddits = other_subreddits.groupby('index', sort=False).agg(', '.join)
+    other_subreddits = other_subreddits.iloc[:, 0].reindex(posts_df.index, fill_value='')
 
-        # author
-        author = record['author']
-        record['author'] = f'[{author}](https://reddit.com/user/{author})'
+    # title
+    link = posts_df['link'].astype(str)
+    title = posts_df['title'].str.replace('|', '-', regex=False)
+    title = '[' + title + '](' + link + ')'
 
-        # timestamp
-        timestamp = int(record['timestamp']) / 1000
-        record['timestamp'] = dt.datetime.fromtimestamp(timestamp)
-        record['timestamp'] = record['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+    # comments
+    comments = (posts_df['comments_count'].astype(str)
+                + ' ([view](' + posts_df['comments'].astype(str) + '))')
 
-        # title
-        title = record['title'].replace('|', '-')
-        link = record['link']
-        record['title'] = f'[{title}]({link})'
+    # domain
+    domain = posts_df['domain']
+    is_reddit = domain.isin(['old.reddit.com', 'np.reddit.com'])
+    links_to_reddit = is_reddit & link.str.contains('reddit.com', regex=False)
 
-        # comments
-        comment_count = record['comments_count']
-        comment_link = record['comments']
-        record['comments'] = f'{comment_count} ([view]({comment_link}))'
+    reddit_path = link[links_to_reddit].str.split('reddit.com/').str[1]
+    reddit_path = reddit_path.str.split('/').str[:2].str.join('/')
+    domain = domain.mask(links_to_reddit, 'reddit.com/' + reddit_path)
+    domain = domain.mask(is_reddit, '[' + domain + '](https://' + domain + ')')
 
-        # domain
-        domain = record['domain']
-        if domain in ('old.reddit.com', 'np.reddit.com'):
-            if link.find('reddit.com') != -1:
-                domain = 'reddit.com/' + '/'.join(link.split('reddit.com/')[1].split('/')[:2])
-            record['domain'] = f'[{domain}](https://{domain})'
+    return pd.DataFrame({'Title': title,
+                         'Source': domain,
+                         'Score': posts_df['score'],
+                         'Comments': comments,
+                         'Author': 'u/' + posts_df['author_display'],
+                         'Post/Comment Karma Ratio': posts_df['karma_ratio'],
+                         'Moderator Of': posts_df['moderator_of'],
+                         'X-post Subreddits': other_subreddits,
+                         'Buzzwords': posts_df['buzzwords']})
 
-        new_record = {'Title': record['title'],
-                      'Source': record['domain'],
-                      'Score': record['score'],
-                      'Comments': record['comments'],
-                      'Author': 'u/' + record['author_display'],
-                      'Post/Comment Karma Ratio': record['karma_ratio'],
-                      'Moderator Of': record['moderator_of'],
-                      'X-post Subreddits': record['other_subreddits'],
-                      'Buzzwords': record['buzzwords']}
 
-        processed_records.append(new_record)
+def build(metrics=None):
+    metrics = metrics or Metrics()
 
-    return processed_records
+    last_week_str = Catalog.load().latest_before(today_str, LOOKBACK_DAYS,
+                                                 tables=('posts', 'authors'))
+    if last_week_str is None:
+        raise FileNotFoundError(f'no snapshot {LOOKBACK_DAYS} or more days older '
+                                f'than {today_str}')
 
+    last_week_propaganda_posts_df = snapshot.load(last_week_str, 'posts', ['post_id'])
+    last_week_author_df = snapshot.load(last_week_str, 'authors', ['username'])
 
-def build():
-    last_week_author_posts_df = pd.read_csv(f'data/{last_week_str}/propaganda_author_submissions.csv')
-    last_week_propaganda_posts_df = pd.read_csv(f'data/{last_week_str}/propaganda_posts.csv')
-    last_week_author_df = pd.read_json(f'data/{last_week_str}/propaganda_authors.json')
+    author_posts_df = snapshot.load(today_str, 'author_submissions')
+    propaganda_posts_df = snapshot.load(today_str, 'posts')
+    author_df = snapshot.load(today_str, 'authors')
 
-    author_posts_df = pd.read_csv(f'data/{today_str}/propaganda_author_submissions.csv')
-    propaganda_posts_df = pd.read_csv(f'data/{today_str}/propaganda_posts.csv')
-    author_df = pd.read_json(f'data/{today_str}/propaganda_authors.json')
-
-    # new_author_posts = author_posts_df.post_id.isin(last_week_author_posts_df.post_id)
     new_propaganda_posts = ~propaganda_posts_df.post_id.isin(last_week_propaganda_posts_df.post_id)
     new_authors = ~author_df.username.isin(last_week_author_df.username)
 
@@ -190,12 +151,9 @@ def build():
 
     post_records_with_buzzwords = process_buzzwords(post_records_with_crossposts)
 
-    processed_records = prepare_data(post_records_with_buzzwords)
-
-    sort_kwargs = {'key': lambda n: n['Score'], 'reverse': True}
-    processed_records = sorted(processed_records, **sort_kwargs)
+    processed_data = prepare_data(post_records_with_buzzwords)
+    processed_data = processed_data.sort_values('Score', ascending=False, kind='stable')
 
-    processed_data = pd.DataFrame(processed_records)
     posts_report = processed_data[['Title', 'Source', 'Comments', 'Score', 'Author', 'X-post Subreddits']]
     users_columns = ['Author', 'Post/Comment Karma Ratio', 'Moderator Of', 'Buzzwords']
     users_report = processed_data.groupby(users_columns)['Title'].count()
@@ -203,6 +161,11 @@ def build():
     users_report = users_report.rename({'Title': 'Post Count'}, axis=1)
     users_report = users_report.sort_values('Post Count', ascending=False)
 
+    metrics.rows('report', 'posts', len(propaganda_posts_df))
+    metrics.rows('report', 'author_submissions', len(author_posts_df))
+    metrics.rows('report', 'propaganda_posts', len(posts_report))
+    metrics.rows('report', 'propaganda_users', len(users_report))
+
     print(f'Last Week: {last_week_str}')
     print(f'New Posts Count: {len(posts_report)}')
     print(f'This Week\'s Author Count: {len(users_report)}')
@@ -213,7 +176,9 @@ def build():
 
 def analyze_domains():
     '''DO NOT USE - work-in-progress'''
-    author_posts_df = pd.read_csv(f'data/{today_str}/propaganda_author_submissions.csv')
+    from whois import whois
+
+    author_posts_df = snapshot.load(today_str, 'author_submissions', ['type', 'domain'])
     author_posts_df = author_posts_df[author_posts_df.type != 'text']
     author_posts_df = author_posts_df.drop('type', axis=1)
 
@@ -233,9 +198,15 @@ def analyze_domains():
 
 
 def download_posts_from_subreddits(subreddits: list):
-    all_zee_posts = list()
-    for subreddit in subreddits:
-        all_zee_posts += SubredditScraper.posts(subreddit)
+    from scrape import SubredditScraper
+
+    scraper = SubredditScraper()
+    try:
+        all_zee_posts = list()
+        for posts in scraper.fetcher.map(scraper.posts, subreddits):
+            all_zee_posts += posts
+    finally:
+        scraper.close()
 
     all_zee_posts_df = pd.DataFrame(all_zee_posts)
     all_zee_posts_df.to_csv('all_the_posts.csv', index=False)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+from requests.structures import CaseInsensitiveDict
+
+from atomic import atomic_open
+
+
+CACHE_DIR = 'cache/responses'
+
+# seconds a stored page is served as-is before it is revalidated
+MAX_AGE = 6 * 60 * 60
+
+# the only headers worth keeping; the rest are per-connection noise
+STORED_HEADERS = ('content-type', 'etag', 'last-modified', 'location')
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    '''raw old.reddit pages on disk, addressed by the sha256 of their body
+
+    Each request is indexed by a hash of its method, URL, params and form
+    data; the index entry points at the stored body and records the status,
+    validators and redirect history needed to rebuild the response.
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_age=MAX_AGE, replay=False):
+        self.directory = directory
+        self.max_age = max_age
+        self.replay = replay
+
+    @staticmethod
+    def key(method: str, url: str, params=None, data=None) -> str:
+        request = json.dumps([method.upper(), url, params, data], sort_keys=True)
+        return hashlib.sha256(request.encode('utf8')).hexdigest()
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.directory, 'index', key[:2], f'{key}.json')
+
+    def _body_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, 'bodies', content_hash[:2],
+                            f'{content_hash}.html')
+
+    def lookup(self, key: str):
+        try:
+            with open(self._index_path(key), encoding='utf8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def is_fresh(self, entry: dict) -> bool:
+        return (self.max_age is not None
+                and time.time() - entry['fetched_at'] < self.max_age)
+
+    @staticmethod
+    def conditional_headers(entry) -> dict:
+        if entry is None:
+            return {}
+
+        headers = dict()
+        if 'etag' in entry['headers']:
+            headers['If-None-Match'] = entry['headers']['etag']
+        if 'last-modified' in entry['headers']:
+            headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        return headers
+
+    def store(self, key: str, response: requests.Response) -> dict:
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        body_path = self._body_path(content_hash)
+
+        if not os.path.exists(body_path):
+            with atomic_open(body_path, 'wb') as file:
+                file.write(response.content)
+
+        def stored_headers(r):
+            return {k: v for k, v in r.headers.lower_items() if k in STORED_HEADERS}
+
+        entry = {'method': response.request.method,
+                 'url': response.url,
+                 'status_code': response.status_code,
+                 'encoding': response.encoding,
+                 'headers': stored_headers(response),
+                 'history': [{'url': r.url,
+                              'status_code': r.status_code,
+                              'headers': stored_headers(r)}
+                             for r in response.history],
+                 'body': content_hash,
+                 'fetched_at': time.time()}
+
+        self._write_entry(key, entry)
+
+        return entry
+
+    def touch(self, key: str, entry: dict):
+        '''mark a revalidated entry as freshly fetched'''
+        self._write_entry(key, dict(entry, fetched_at=time.time()))
+
+    def _write_entry(self, key: str, entry: dict):
+        with atomic_open(self._index_path(key), 'w', encoding='utf8') as file:
+            json.dump(entry, file)
+
+    def body(self, entry: dict) -> bytes:
+        with open(self._body_path(entry['body']), 'rb') as file:
+            return file.read()
+
+    def load(self, entry: dict) -> requests.Response:
+        def build(stored):
+            response = requests.Response()
+            response.url = stored['url']
+            response.status_code = stored['status_code']
+            response.headers = CaseInsensitiveDict(stored['headers'])
+            return response
+
+        response = build(entry)
+        response.encoding = entry['encoding']
+        response.history = [build(r) for r in entry['history']]
+        response._content = self.body(entry)
+
+        return response
+
+    def entries(self):
+        index_directory = os.path.join(self.directory, 'index')
+
+        for root, _, files in os.walk(index_directory):
+            for name in files:
+                if name.endswith('.json'):
+                    yield self.lookup(name[:-len('.json')])
@@ -1,96 +1,254 @@
-
+import collections
 import datetime as dt
-import requests
-import pandas as pd
 import bs4
+import lxml.etree
+import lxml.html
 import time
-import os
+import urllib.parse
 
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from author_cache import AuthorCache
+from consent import ConsentStore, is_over_18_gate
+from crawl import Crawler, MAX_CONCURRENT
+from fetch import Fetcher, MAX_WORKERS
+from metrics import Metrics
+from rate_limit import RateLimiter
+from response_cache import ResponseCache, ReplayMiss
+from sink import SnapshotSink, RecordCollector
 
 REDDIT_ROOT_URL = 'old.reddit.com'
 
-# use a standard browser agent to circumvent reddit blocking the requests
-MOZILLA_USER_AGENT = {'User-Agent': 'Mozilla/5.0'}
+# the most posts old.reddit will return for a single listing page
+PAGE_SIZE = 100
 
 TIMEOUT = 5
 
+# authors fetched ahead of the one being written, per fetch worker
+AUTHORS_AHEAD_PER_WORKER = 2
+
+# 'lxml' parses listings with XPath straight off the lxml tree; 'bs4' is the
+# original BeautifulSoup walk, kept as a reference
+PARSER = 'lxml'
+
+
+def has_class(name: str) -> str:
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+# same elements as the soup's find(id='siteTable').find_all(class_='thing')
+LISTING_POSTS = lxml.etree.XPath(f'(//*[@id="siteTable"])[1]//*[{has_class("thing")}]')
+LISTING_NEXT_PAGE = lxml.etree.XPath(f'(//span[{has_class("next-button")}]/a)[1]/@href')
+POST_TITLE = lxml.etree.XPath(f'(.//a[{has_class("title")}])[1]')
+
+
+class UnknownRedirect(Exception):
+    pass
+
+
+def start_driver_pool(consent: ConsentStore, rate_limiter: RateLimiter, browser_count=None,
+                      headless=True, recycle_after=None):
+    '''a pool of Firefox drivers that start with the stored consent cookies'''
+    # selenium is only imported when a browser is actually wanted
+    from browser import DriverPool, POOL_SIZE, RECYCLE_AFTER
+
+    def setup_driver(driver):
+        consent.apply_to_driver(driver, REDDIT_ROOT_URL, rate_limiter)
+
+    return DriverPool(browser_count or POOL_SIZE, headless,
+                      recycle_after or RECYCLE_AFTER,
+                      rate_limiter=rate_limiter,
+                      setup_driver=setup_driver)
+
 
 class SubredditScraper:
 
-    def __init__(self, headless=True):
-        profile = webdriver.FirefoxProfile()
-        profile.add_extension(extension='ublock_origin-1.37.2-an+fx.xpi')
+    def __init__(self, headless=True, max_workers=MAX_WORKERS, use_browser=False,
+                 browser_count=None, recycle_after=None,
+                 author_cache=None, response_cache=None, rate_limiter=None,
+                 consent=None, metrics=None, fetcher=None, driver_pool=None):
+        # a single limiter paces both the HTTP and the browser page loads
+        rate_limiter = rate_limiter or RateLimiter()
 
-        options = webdriver.FirefoxOptions()
-        options.headless = headless
+        # a fetcher or driver pool passed in is shared by the scrapers of a
+        # whole run, and closed by whoever started it
+        self.owns_fetcher = fetcher is None
+        self.owns_driver_pool = driver_pool is None
 
-        self.driver = webdriver.Firefox(profile, options=options)
+        self.fetcher = fetcher or Fetcher(max_workers, response_cache, rate_limiter, metrics)
+        self.author_cache = author_cache
+
+        # consent given in earlier runs (or by other scrapers) is reused, so
+        # the over18 and quarantine forms are only posted when reddit asks
+        self.consent = consent or ConsentStore()
+        self.consent.apply_to_session(self.fetcher.session)
+
+        # the browser is only started when explicitly requested; profiles are
+        # otherwise parsed straight from the old.reddit HTML
+        self.driver_pool = driver_pool
+
+        if driver_pool is None and use_browser:
+            self.driver_pool = start_driver_pool(self.consent, self.fetcher.rate_limiter,
+                                                 browser_count, headless, recycle_after)
 
     def close(self):
-        self.driver.quit()
+        if self.driver_pool is not None and self.owns_driver_pool:
+            self.driver_pool.close()
+        if self.owns_fetcher:
+            self.fetcher.close()
+
+    @staticmethod
+    def build_post_record(post, title_href: str, title: str) -> dict:
+        author = post.get('data-author', '[deleted]')
+
+        post_id = post.get('id')
+        subreddit = post.get('data-subreddit')
+        domain = post.get('data-domain')
+        comments = f'https://{REDDIT_ROOT_URL}' + post.get('data-permalink')
+        comments_count = post.get('data-comments-count')
+        score = post.get('data-score')
+        timestamp = post.get('data-timestamp')
+
+        if domain == f'self.{subreddit}':
+            post_type = 'text'
+        elif domain in ('youtube.com', 'youtu.be',
+                        'vimeo.com', 'v.redd.it'):
+            post_type = 'video'
+        elif domain in ('imgur.com', 'i.imgur.com', 'i.redd.it'):
+            post_type = 'image'
+        else:
+            post_type = 'link'
+
+        link = (None if domain == f'self.{subreddit}'
+                else title_href)
+        link = (link if link is None or link[0] != '/'
+                else 'https://' + REDDIT_ROOT_URL + link)
+
+        domain = None if domain == f'self.{subreddit}' else domain
+
+        post_record = {'post_id': post_id,
+                       'subreddit': subreddit,
+                       'author': author,
+                       'timestamp': timestamp,
+                       'type': post_type,
+                       'domain': domain,
+                       'title': title,
+                       'score': score,
+                       'comments_count': comments_count,
+                       'link': link,
+                       'comments': comments}
+
+        return post_record
 
     @staticmethod
     def parse_posts_to_records(posts):
         post_records = list()
         for post in posts:
-            author = post.get('data-author', '[deleted]')
-
-            post_id = post['id']
-            subreddit = post['data-subreddit']
-            domain = post['data-domain']
-            comments = f'https://{REDDIT_ROOT_URL}' + post['data-permalink']
-            comments_count = post['data-comments-count']
-            score = post['data-score']
-            timestamp = post['data-timestamp']
-
             title_soup = post.find('a', attrs={'class': 'title'})
+            post_record = SubredditScraper.build_post_record(post, title_soup.get('href'),
+                                                             title_soup.get_text())
+            post_records.append(post_record)
 
-            if domain == f'self.{subreddit}':
-                post_type = 'text'
-            elif domain in ('youtube.com', 'youtu.be',
-                            'vimeo.com', 'v.redd.it'):
-                post_type = 'video'
-            elif domain in ('imgur.com', 'i.imgur.com', 'i.redd.it'):
-                post_type = 'image'
-            else:
-                post_type = 'link'
+        return post_records
+
+    @staticmethod
+    def parse_lxml_posts_to_records(posts):
+        post_records = list()
+        for post in posts:
+            title = POST_TITLE(post)[0]
+            post_record = SubredditScraper.build_post_record(post, title.get('href'),
+                                                             title.text_content())
+            post_records.append(post_record)
 
-            link = (None if domain == f'self.{subreddit}'
-                    else title_soup['href'])
-            link = (link if link is None or link[0] != '/'
-                    else 'https://' + REDDIT_ROOT_URL + link)
+        return post_records
 
-            domain = None if domain == f'self.{subreddit}' else domain
+    @staticmethod
+    def parse_listing(html: str, parser=PARSER) -> tuple:
+        if parser == 'lxml':
+            return SubredditScraper.parse_lxml_listing(html)
 
-            title = title_soup.get_text()
+        listing_soup = bs4.BeautifulSoup(html, 'lxml')
+        posts_table = listing_soup.find(attrs={'id': 'siteTable'})
+        posts = posts_table.find_all(attrs={'class': 'thing'})
+        post_records = SubredditScraper.parse_posts_to_records(posts)
 
-            post_record = {'post_id': post_id,
-                           'subreddit': subreddit,
-                           'author': author,
-                           'timestamp': timestamp,
-                           'type': post_type,
-                           'domain': domain,
-                           'title': title,
-                           'score': score,
-                           'comments_count': comments_count,
-                           'link': link,
-                           'comments': comments}
+        # the "next" button carries the cursor for the following page
+        next_button = listing_soup.select_one('span.next-button > a')
+        if next_button is None:
+            return post_records, None
 
-            post_records.append(post_record)
+        query = urllib.parse.urlparse(next_button['href']).query
+        after = urllib.parse.parse_qs(query).get('after', [None])[0]
 
-        return post_records
+        return post_records, after
 
     @staticmethod
-    def posts(subreddit: str) -> list:
-        subreddit_url = f'https://{REDDIT_ROOT_URL}/r/{subreddit}?limit=100'
-        response = requests.get(subreddit_url, headers=MOZILLA_USER_AGENT)
+    def parse_lxml_listing(html: str) -> tuple:
+        page = lxml.html.fromstring(html)
+        post_records = SubredditScraper.parse_lxml_posts_to_records(LISTING_POSTS(page))
+
+        next_page = LISTING_NEXT_PAGE(page)
+        if not next_page:
+            return post_records, None
+
+        query = urllib.parse.urlparse(next_page[0]).query
+        after = urllib.parse.parse_qs(query).get('after', [None])[0]
+
+        return post_records, after
+
+    def iter_listing(self, listing_url: str, request_page, limit=None,
+                     max_pages=None, since=None, until_post_id=None):
+        '''yield records from `listing_url`, following the `after=` cursor
+
+        `request_page(url)` returns the page's response along with a dict of
+        fields to add to each of its records. Paging stops after `limit`
+        records, after `max_pages` pages, after the page holding
+        `until_post_id`, or once a whole page is older than `since` (a
+        millisecond timestamp, like the records' own); records older than
+        `since` are never yielded.
+        '''
+        page_size = PAGE_SIZE if limit is None else min(limit, PAGE_SIZE)
+        separator = '&' if '?' in listing_url else '?'
+        listing_url = f'{listing_url}{separator}limit={page_size}'
+
+        record_count = 0
+        page_count = 0
+        after = None
+
+        while True:
+            page_url = (listing_url if after is None
+                        else f'{listing_url}&count={record_count}&after={after}')
+
+            response, page_fields = request_page(page_url)
+            post_records, after = self.parse_listing(response.text)
+            page_count += 1
+
+            page_is_stale = since is not None
+            page_has_until = False
+            for record in post_records:
+                if record['post_id'] == until_post_id:
+                    page_has_until = True
+
+                if since is not None and int(record['timestamp']) < since:
+                    continue
+
+                page_is_stale = False
+                yield dict(page_fields, **record)
 
-        is_quarantined = False
+                record_count += 1
+                if limit is not None and record_count >= limit:
+                    return
+
+            if after is None or page_is_stale or page_has_until:
+                return
+
+            if max_pages is not None and page_count >= max_pages:
+                return
+
+    def request_subreddit_page(self, subreddit: str, page_url: str) -> tuple:
+        response = self.fetcher.get(page_url)
+
+        # with the consent cookie set a quarantined subreddit is served like
+        # any other, so its status is remembered from when it last asked
+        is_quarantined = self.consent.is_quarantined(subreddit)
 
         if response.status_code == 403:
             redirect_history = response.history.pop()
@@ -101,81 +259,210 @@ class SubredditScraper:
 
                 if redirect_location == 'quarantine':
                     is_quarantined = True
-                    response = SubredditScraper.verify_quarantine(subreddit)
+                    response = self.verify_quarantine(subreddit, page_url)
+                    self.consent.record_session(self.fetcher.session)
                 else:
-                    raise Exception(f'Unknown Redirect: {redirect_location}')
+                    raise UnknownRedirect(redirect_location)
 
-        subreddit_soup = bs4.BeautifulSoup(response.text, 'lxml')
-        posts_table = subreddit_soup.find(attrs={'id': 'siteTable'})
-        posts = posts_table.find_all(attrs={'class': 'thing'})
-        post_records = SubredditScraper.parse_posts_to_records(posts)
+        self.consent.set_quarantined(subreddit, is_quarantined)
 
-        post_records = [dict(quarantined=is_quarantined, **p)
-                        for p in post_records]
+        return response, {'quarantined': is_quarantined}
 
-        return post_records
+    def iter_posts(self, subreddit: str, limit=None, max_pages=None, since=None):
+        subreddit_url = f'https://{REDDIT_ROOT_URL}/r/{subreddit}'
 
-    @staticmethod
-    def verify_over_18(target_url: str):
-        over_18_url = (f'https://{REDDIT_ROOT_URL}/over18'
-                       f'?dest={target_url}')
+        def request_page(page_url):
+            return self.request_subreddit_page(subreddit, page_url)
+
+        return self.iter_listing(subreddit_url, request_page,
+                                 limit, max_pages, since)
+
+    def posts(self, subreddit: str, limit=PAGE_SIZE) -> list:
+        return list(self.iter_posts(subreddit, limit))
+
+    def verify_over_18(self, target_url: str):
+        over_18_url = f'https://{REDDIT_ROOT_URL}/over18'
 
         request_kwargs = {'url': over_18_url,
-                          'headers': MOZILLA_USER_AGENT,
+                          'params': {'dest': target_url},
                           'data': {'over18': 'yes'}}
 
-        return requests.post(**request_kwargs)
+        return self.fetcher.post(**request_kwargs)
 
-    @staticmethod
-    def verify_quarantine(subreddit: str):
-        target_url = f'https://{REDDIT_ROOT_URL}/r/{subreddit}'
-        quarantine_url = (f'https://{REDDIT_ROOT_URL}/quarantine'
-                          f'?dest={target_url}')
+    def get_over_18(self, target_url: str):
+        '''GET a page that may sit behind the over18 interstitial'''
+        if self.consent.has_over_18():
+            try:
+                response = self.fetcher.get(target_url)
+            except ReplayMiss:
+                # recorded before the cookie was kept: the page was stored as
+                # the answer to the over18 form, which is replayed instead
+                response = None
+
+            if response is not None and not is_over_18_gate(response):
+                return response
+
+        try:
+            response = self.verify_over_18(target_url)
+        except ReplayMiss:
+            # recorded with the cookie already set, so only the GET was stored
+            return self.fetcher.get(target_url)
+
+        self.consent.record_session(self.fetcher.session)
+
+        return response
+
+    def verify_quarantine(self, subreddit: str, target_url=None):
+        if target_url is None:
+            target_url = f'https://{REDDIT_ROOT_URL}/r/{subreddit}'
+
+        quarantine_url = f'https://{REDDIT_ROOT_URL}/quarantine'
 
         request_kwargs = {'url': quarantine_url,
-                          'headers': MOZILLA_USER_AGENT,
+                          'params': {'dest': target_url},
                           'data': {'sr_name': subreddit,
                                    'accept': 'yes'}}
 
-        return requests.post(**request_kwargs)
+        return self.fetcher.post(**request_kwargs)
+
+    def iter_user_submissions(self, author: str, limit=None, max_pages=None,
+                              since=None, until_post_id=None):
+        submissions_url = f'https://{REDDIT_ROOT_URL}/user/{author}/submitted/'
+
+        def request_page(page_url):
+            return self.get_over_18(page_url), {}
+
+        return self.iter_listing(submissions_url, request_page,
+                                 limit, max_pages, since, until_post_id)
+
+    def user_submissions(self, author: str, count=PAGE_SIZE) -> list:
+        if self.author_cache is None:
+            return list(self.iter_user_submissions(author, count))
+
+        # the newest page is always fetched again, so its scores and comment
+        # counts are current and deleted posts drop out; older pages are only
+        # fetched down to the last post seen, the rest are served from the
+        # cache as they were when first fetched
+        if not self.author_cache.submissions_are_fresh(author):
+            latest_post_id = self.author_cache.latest_post_id(author)
+            new_posts = self.iter_user_submissions(author, count,
+                                                   until_post_id=latest_post_id)
+            self.author_cache.store_submissions(author, list(new_posts))
+
+        return self.author_cache.submissions(author, count)
 
     @staticmethod
-    def user_submissions(author: str, count=100):
-        submissions_url = (f'{REDDIT_ROOT_URL}/user/{author}/submitted/'
-                           f'?limit={str(count)}')
+    def normalize_mod_list(hrefs: list) -> list:
+        mod_list = [href.split(REDDIT_ROOT_URL)[-1] for href in hrefs]
+        mod_list = ['/' + ('/'.join([n for n in s.split('/') if n != '']))
+                    for s in mod_list]
 
-        submissions_url = 'https://' + submissions_url
+        return mod_list
 
-        response = SubredditScraper.verify_over_18(submissions_url)
-        submissions_soup = bs4.BeautifulSoup(response.text, 'lxml')
-        posts_table = submissions_soup.find(attrs={'id': 'siteTable'})
-        posts = posts_table.find_all(attrs={'class': 'thing'})
-        post_records = SubredditScraper.parse_posts_to_records(posts)
+    @staticmethod
+    def parse_user_profile(username: str, html: str) -> dict:
+        user_profile = {'username': username,
+                        'suspended': False,
+                        'moderator_of': []}
 
-        return post_records
+        page = lxml.html.fromstring(html)
+
+        sidebar = page.xpath(f'//div[{has_class("side")}]')
+        titlebox = page.xpath(f'//div[{has_class("side")}]//div[{has_class("titlebox")}]')
+
+        if not titlebox:
+            if page.xpath('//a[contains(., "suspended")]'):
+                user_profile['suspended'] = True
+                return user_profile
+
+            raise Exception('titlebox could not be detected')
+
+        sidebar, titlebox = sidebar[0], titlebox[0]
+
+        # account created
+        account_age = titlebox.xpath(f'.//span[{has_class("age")}]/time/@datetime')[0]
+        account_age = dt.datetime.fromisoformat(account_age)
+        user_profile['account_created'] = int(account_age.timestamp())
+
+        # comment karma
+        comment_karma = titlebox.xpath(f'.//span[{has_class("comment-karma")}]')[0]
+        comment_karma = int(comment_karma.text_content().replace(',', ''))
+        user_profile['comment_karma'] = comment_karma
+
+        # post karma
+        post_karma = titlebox.xpath(f'(.//span[{has_class("karma")}])[1]')[0]
+        post_karma = int(post_karma.text_content().replace(',', ''))
+        user_profile['post_karma'] = post_karma
+
+        # mod subreddits
+        mod_list = sidebar.xpath('.//*[@id="side-mod-list"]//a/@href')
+        user_profile['moderator_of'] = SubredditScraper.normalize_mod_list(mod_list)
+
+        return user_profile
 
     def user_profile(self, username: str) -> dict:
+        if self.author_cache is not None:
+            user_profile = self.author_cache.profile(username)
+
+            if user_profile is not None:
+                return user_profile
+
+        if self.driver_pool is not None:
+            user_profile = self.driver_pool.submit(self.browser_user_profile, username).result()
+        else:
+            user_profile = self.http_user_profile(username)
+
+        if self.author_cache is not None:
+            self.author_cache.store_profile(user_profile)
+
+        return user_profile
+
+    def author(self, username: str) -> tuple:
+        '''an author's profile and, unless the account is suspended, submissions'''
+        user_profile = self.user_profile(username)
+
+        if user_profile['suspended']:
+            return user_profile, []
+
+        return user_profile, self.user_submissions(username)
+
+    def http_user_profile(self, username: str) -> dict:
+        user_overview_url = f'https://{REDDIT_ROOT_URL}/user/{username}'
+        response = self.get_over_18(user_overview_url)
+
+        return self.parse_user_profile(username, response.text)
+
+    def browser_user_profile(self, driver, username: str) -> dict:
+        from selenium.common.exceptions import NoSuchElementException, TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
         user_profile = {'username': username,
                         'suspended': False,
                         'moderator_of': []}
 
         user_overview_url = f'https://{REDDIT_ROOT_URL}/user/{username}'
-        over_18_url = (f'https://{REDDIT_ROOT_URL}/over18'
-                       f'?dest={user_overview_url}')
 
-        self.driver.get(over_18_url)
+        driver.get(user_overview_url)
 
+        # drivers start with the stored over18 cookie, so the interstitial
+        # only shows up until consent has been given once
         continue_button_selector = 'div.buttons > button.c-btn[value=yes]'
-        continue_button = (By.CSS_SELECTOR, continue_button_selector)
-        WebDriverWait(self.driver, TIMEOUT).until(EC.element_to_be_clickable(continue_button))
-        self.driver.find_element_by_css_selector(continue_button_selector).click()
+        if driver.find_elements_by_css_selector(continue_button_selector):
+            continue_button = (By.CSS_SELECTOR, continue_button_selector)
+            WebDriverWait(driver, TIMEOUT).until(EC.element_to_be_clickable(continue_button))
+
+            # the click loads the page again; the pool only paced the first load
+            self.fetcher.rate_limiter.acquire()
+            driver.find_element_by_css_selector(continue_button_selector).click()
 
         sidebar_locator = (By.CSS_SELECTOR, 'div.side')
         try:
-            WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located(sidebar_locator))
+            WebDriverWait(driver, TIMEOUT).until(EC.presence_of_element_located(sidebar_locator))
         except TimeoutException as timeout:
             try:
-                self.driver.find_element_by_partial_link_text('suspended')
+                driver.find_element_by_partial_link_text('suspended')
             except NoSuchElementException:
                 raise timeout
             else:
@@ -183,11 +470,11 @@ class SubredditScraper:
                 return user_profile
 
         titlebox_rendered = EC.text_to_be_present_in_element(sidebar_locator, username)
-        sidebar_is_rendered = WebDriverWait(self.driver, TIMEOUT).until(titlebox_rendered)
+        sidebar_is_rendered = WebDriverWait(driver, TIMEOUT).until(titlebox_rendered)
 
         if sidebar_is_rendered:
-            sidebar = self.driver.find_element_by_css_selector('div.side')
-            titlebox = self.driver.find_element_by_css_selector('div.titlebox')
+            sidebar = driver.find_element_by_css_selector('div.side')
+            titlebox = driver.find_element_by_css_selector('div.titlebox')
         else:
             raise Exception('titlebox could not be detected')
 
@@ -216,91 +503,135 @@ class SubredditScraper:
         except NoSuchElementException:
             mod_list = []
         finally:
-            mod_list = [link.get_attribute('href').split(REDDIT_ROOT_URL)[-1]
-                        for link in mod_list]
-            mod_list = ['/' + ('/'.join([n for n in s.split('/') if n != '']))
-                        for s in mod_list]
-            user_profile['moderator_of'] = mod_list
+            mod_list = [link.get_attribute('href') for link in mod_list]
+            user_profile['moderator_of'] = SubredditScraper.normalize_mod_list(mod_list)
 
         return user_profile
 
 
-def scrape(subreddit: str, exclude_authors=set()):
-    scrape = SubredditScraper()
+def scrape(subreddit: str, exclude_authors=set(), max_workers=MAX_WORKERS,
+           use_browser=False, browser_count=None, author_cache=None,
+           response_cache=None, rate_limiter=None, consent=None, metrics=None,
+           sink=None, fetcher=None, driver_pool=None):
+    '''scrape a subreddit's posts and its authors' profiles and submissions
+
+    Records go to `sink` as they come in: the posts first, then each author's
+    profile along with their submissions. Without a sink they are collected
+    and returned as (posts, authors, author submissions) lists.
+    '''
+    metrics = metrics or Metrics()
+
+    collector = None
+    if sink is None:
+        sink = collector = RecordCollector()
+
+    scrape = SubredditScraper(max_workers=max_workers, use_browser=use_browser,
+                              browser_count=browser_count,
+                              author_cache=author_cache,
+                              response_cache=response_cache,
+                              rate_limiter=rate_limiter,
+                              consent=consent,
+                              metrics=metrics,
+                              fetcher=fetcher,
+                              driver_pool=driver_pool)
 
     print('=' * 80)
     print(f'scraping posts from /r/{subreddit}...')
     print('=' * 80)
 
-    post_records = scrape.posts(subreddit)
-    posts_df = pd.DataFrame(post_records)
-
-    author_post_records = list()
-    author_records = list()
-
-    for user in posts_df['author'].unique():
-        if user in exclude_authors:
-            continue
-
+    def write_author(user: str, future):
         print(f'scraping {user}\'s profile...')
-        author = scrape.user_profile(user)
+        author, author_posts = future.result()
 
         if not author['suspended']:
             print(f'scraping {user}\'s submissions...')
-            author_posts = scrape.user_submissions(user)
-            author_post_records += author_posts
 
-        author_records.append(author)
+        sink.write_author(author, author_posts)
+        metrics.rows('scrape', 'authors', 1)
+        metrics.rows('scrape', 'author_submissions', len(author_posts))
+
+    pending = collections.deque()
+    try:
+        post_records = scrape.posts(subreddit)
+        sink.write('posts', post_records)
+        metrics.rows('scrape', 'posts', len(post_records))
+
+        authors = [user for user in dict.fromkeys(p['author'] for p in post_records)
+                   if user not in exclude_authors]
 
-    return post_records, author_records, author_post_records
+        # authors are fetched in the background, each by one task that only
+        # asks for the submissions once the profile shows the account is not
+        # suspended. Only a few authors are fetched ahead of the one being
+        # written, so memory stays flat however many authors there are
+        for user in authors:
+            pending.append((user, scrape.fetcher.submit(scrape.author, user)))
 
+            if len(pending) > max_workers * AUTHORS_AHEAD_PER_WORKER:
+                write_author(*pending.popleft())
 
-def download_subreddit_posts(subreddit: str, depth=1, exclude_authors=set()):
-    if depth > 0:
-        depth -= 1
-        layer_posts, layer_authors, layer_author_posts = scrape(subreddit, exclude_authors)
+        while pending:
+            write_author(*pending.popleft())
+    finally:
+        for _, future in pending:
+            future.cancel()
+        scrape.close()
 
-        unique_authors = set(a['username'] for a in layer_authors)
-        subreddits = set(s['subreddit'] for s in layer_author_posts)
+    if collector is not None:
+        return tuple(collector.records[name]
+                     for name in ('posts', 'authors', 'author_submissions'))
 
-        download_kwargs = {'exclude_authors': unique_authors,
-                           'depth': depth}
 
-        for subreddit in subreddits:
-            posts, authors, author_posts = download_subreddit_posts(subreddit, **download_kwargs)
-            layer_posts += posts
-            layer_authors += authors
-            layer_author_posts += author_posts
-    else:
-        layer_posts, layer_authors, layer_author_posts = scrape(subreddit, exclude_authors)
+def download_subreddit_posts(subreddit: str, depth=1, exclude_authors=set(),
+                             depth_limits=None, max_concurrent=MAX_CONCURRENT,
+                             sink=None, **scrape_kwargs):
+    sink = sink or SnapshotSink(subreddit)
 
-    return layer_posts, layer_authors, layer_author_posts
+    crawler = Crawler(scrape, subreddit, sink, depth, depth_limits,
+                      max_concurrent, exclude_authors, **scrape_kwargs)
+    crawler.run()
 
+    return sink.close()
 
 
 def save_records(subreddit, post_records, author_records, author_posts_records):
-    posts_df = pd.DataFrame(post_records)
-    author_posts_df = pd.DataFrame(author_posts_records)
-    author_df = pd.DataFrame(author_records)
-
-    date_str = dt.date.today().strftime('%Y%m%d')
+    sink = SnapshotSink(subreddit)
+    sink.write('posts', post_records)
+    sink.write('authors', author_records)
+    sink.write('author_submissions', author_posts_records)
+
+    return sink.close()
+
+
+def main(subreddit='propaganda', depth=0, replay=False, max_workers=MAX_WORKERS,
+         use_browser=False, metrics=None):
+    author_cache = AuthorCache()
+    response_cache = ResponseCache(replay=replay)
+    rate_limiter = RateLimiter()
+    consent = ConsentStore()
+    metrics = metrics or Metrics()
+
+    # every subreddit of the crawl shares one session, with its keep-alive
+    # connections, one set of fetch workers and one pool of browsers
+    fetcher = Fetcher(max_workers, response_cache, rate_limiter, metrics)
+    driver_pool = start_driver_pool(consent, rate_limiter) if use_browser else None
+
+    scrape_kwargs = {'author_cache': author_cache,
+                     'response_cache': response_cache,
+                     'rate_limiter': rate_limiter,
+                     'consent': consent,
+                     'max_workers': max_workers,
+                     'use_browser': use_browser,
+                     'metrics': metrics,
+                     'fetcher': fetcher,
+                     'driver_pool': driver_pool}
 
     try:
-        os.mkdir(f'data/{date_str}')
-    except FileExistsError:
-        pass
+        download_subreddit_posts(subreddit, depth, **scrape_kwargs)
     finally:
-        os.chdir(f'data/{date_str}')
-
-    posts_df.to_csv(f'{subreddit}_posts.csv', index=False)
-    author_posts_df.to_csv(f'{subreddit}_author_submissions.csv', index=False)
-    author_df.to_json(f'{subreddit}_authors.json', orient='records')
-
-
-
-def main():
-    subreddit = 'propaganda'
-    save_records(subreddit, *download_subreddit_posts(subreddit, 0))
+        if driver_pool is not None:
+            driver_pool.close()
+        fetcher.close()
+        author_cache.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+import datetime as dt
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from atomic import atomic_open, atomic_path
+from catalog import Catalog
+from snapshot import write_parquet
+
+DATA_DIR = 'data'
+
+# unfinished snapshots are kept here, one directory per subreddit
+PARTS_DIR = '.parts'
+
+BATCH_SIZE = 1000
+
+# record stream -> file name suffix in the day's snapshot
+SNAPSHOT_FILES = {'posts': 'posts.csv',
+                  'author_submissions': 'author_submissions.csv',
+                  'authors': 'authors.json'}
+
+
+class SnapshotSink:
+    '''stream scraped records into `data/<date>/<subreddit>_*` in batches
+
+    Every flush writes the buffered records of a stream as a new numbered
+    part file (written to a temp file and renamed into place), so a run that
+    dies part-way still leaves complete, readable parts behind. `close`
+    stitches the parts into the usual snapshot files, again through a temp
+    file and a rename, removes them, writes the Parquet copy and records the
+    snapshot in the catalog.
+    '''
+
+    def __init__(self, subreddit: str, date_str=None, data_dir=DATA_DIR,
+                 batch_size=BATCH_SIZE):
+        date_str = date_str or dt.date.today().strftime('%Y%m%d')
+
+        self.subreddit = subreddit
+        self.date_str = date_str
+        self.data_dir = data_dir
+        self.batch_size = batch_size
+        self.directory = os.path.join(data_dir, date_str)
+        self.parts_directory = os.path.join(self.directory, PARTS_DIR, subreddit)
+
+        self.buffers = {name: list() for name in SNAPSHOT_FILES}
+        self.columns = {name: None for name in SNAPSHOT_FILES}
+
+        os.makedirs(self.parts_directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{self.subreddit}_{SNAPSHOT_FILES[name]}')
+
+    @staticmethod
+    def _part_extension(name: str) -> str:
+        return 'jsonl' if name == 'authors' else 'csv'
+
+    def _parts(self, name: str) -> list:
+        pattern = f'{name}-[0-9][0-9][0-9][0-9][0-9].{self._part_extension(name)}'
+        return sorted(glob.glob(os.path.join(self.parts_directory, pattern)))
+
+    def part_counts(self) -> dict:
+        return {name: len(self._parts(name)) for name in SNAPSHOT_FILES}
+
+    def truncate(self, part_counts: dict):
+        '''drop buffered records and any parts written after `part_counts`'''
+        for name in SNAPSHOT_FILES:
+            self.buffers[name] = list()
+
+            for part in self._parts(name)[part_counts.get(name, 0):]:
+                os.remove(part)
+
+    def reset(self):
+        self.truncate(dict())
+
+    def write(self, name: str, records: list) -> bool:
+        '''buffer records; returns whether a part was written'''
+        self.buffers[name] += records
+
+        if len(self.buffers[name]) >= self.batch_size:
+            self._flush_stream(name)
+            return True
+
+        return False
+
+    def write_author(self, author: dict, author_posts: list) -> bool:
+        flushed = self.write('authors', [author])
+        return self.write('author_submissions', author_posts) or flushed
+
+    def flush(self):
+        for name in SNAPSHOT_FILES:
+            self._flush_stream(name)
+
+    def _flush_stream(self, name: str):
+        records = self.buffers[name]
+        if not records:
+            return
+
+        part_number = len(self._parts(name))
+        extension = self._part_extension(name)
+        part_path = os.path.join(self.parts_directory,
+                                 f'{name}-{part_number:05d}.{extension}')
+
+        if name == 'authors':
+            with atomic_open(part_path, 'w', encoding='utf8') as file:
+                for record in records:
+                    file.write(json.dumps(record) + '\n')
+        else:
+            # every part of a stream shares the columns of its first record
+            if self.columns[name] is None:
+                self.columns[name] = list(records[0])
+
+            part_df = pd.DataFrame(records, columns=self.columns[name])
+            with atomic_path(part_path) as temp_path:
+                part_df.to_csv(temp_path, index=False)
+
+        self.buffers[name] = list()
+
+    def _consolidate_csv(self, name: str, temp_path: str):
+        with open(temp_path, 'w', encoding='utf8', newline='') as snapshot:
+            for i, part in enumerate(self._parts(name)):
+                with open(part, encoding='utf8', newline='') as file:
+                    header = file.readline()
+                    if i == 0:
+                        snapshot.write(header)
+                    shutil.copyfileobj(file, snapshot)
+
+    def _consolidate_json(self, name: str, temp_path: str):
+        # authors may be missing fields (suspended accounts have no karma), so
+        # every record is written with the union of all fields, like pandas
+        columns = dict()
+        for part in self._parts(name):
+            with open(part, encoding='utf8') as file:
+                for line in file:
+                    columns.update(dict.fromkeys(json.loads(line)))
+
+        with open(temp_path, 'w', encoding='utf8') as snapshot:
+            snapshot.write('[')
+            separator = ''
+            for part in self._parts(name):
+                with open(part, encoding='utf8') as file:
+                    for line in file:
+                        record = json.loads(line)
+                        record = {column: record.get(column) for column in columns}
+                        snapshot.write(separator + json.dumps(record, separators=(',', ':')))
+                        separator = ','
+            snapshot.write(']')
+
+    def close(self) -> dict:
+        self.flush()
+
+        paths = dict()
+        for name in SNAPSHOT_FILES:
+            path = self.path(name)
+
+            with atomic_path(path) as temp_path:
+                if name == 'authors':
+                    self._consolidate_json(name, temp_path)
+                else:
+                    self._consolidate_csv(name, temp_path)
+
+            paths[name] = path
+
+        write_parquet(self.date_str, self.subreddit, self.data_dir)
+
+        shutil.rmtree(self.parts_directory, ignore_errors=True)
+
+        parts_root = os.path.dirname(self.parts_directory)
+        if os.path.isdir(parts_root) and not os.listdir(parts_root):
+            os.rmdir(parts_root)
+
+        Catalog.load(self.data_dir).register(self.date_str)
+
+        return paths
+
+
+class RecordCollector:
+    '''a sink that keeps the records in memory, for callers that want them back'''
+
+    def __init__(self):
+        self.records = {name: list() for name in SNAPSHOT_FILES}
+
+    def write(self, name: str, records: list) -> bool:
+        self.records[name] += records
+        return False
+
+    def write_author(self, author: dict, author_posts: list) -> bool:
+        self.write('authors', [author])
+        return self.write('author_submissions', author_posts)
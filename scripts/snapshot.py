@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from atomic import atomic_path
+
+
+DATA_DIR = 'data'
+
+SUBREDDIT = 'propaganda'
+
+TABLES = ('posts', 'author_submissions', 'authors')
+
+# repeated heavily across rows, so they are stored dictionary-encoded
+DICTIONARY_COLUMNS = ('author', 'subreddit', 'domain')
+
+POST_TYPES = {'quarantined': pa.bool_(),
+              'post_id': pa.string(),
+              'subreddit': pa.string(),
+              'author': pa.string(),
+              'timestamp': pa.int64(),
+              'type': pa.string(),
+              'domain': pa.string(),
+              'title': pa.string(),
+              'score': pa.int64(),
+              'comments_count': pa.int64(),
+              'link': pa.string(),
+              'comments': pa.string()}
+
+AUTHOR_TYPES = {'username': pa.string(),
+                'suspended': pa.bool_(),
+                'moderator_of': pa.list_(pa.string()),
+                'account_created': pa.int64(),
+                'comment_karma': pa.int64(),
+                'post_karma': pa.int64()}
+
+CSV_BLOCK_SIZE = 1 << 22
+
+
+def snapshot_path(date_str: str, table: str, extension: str,
+                  subreddit=SUBREDDIT, data_dir=DATA_DIR) -> str:
+    path = os.path.join(data_dir, date_str, f'{subreddit}_{table}.{extension}')
+
+    # the earliest snapshots carried the date in their file names
+    legacy_path = os.path.join(data_dir, date_str,
+                               f'{subreddit}_{table}_{date_str}.{extension}')
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        return legacy_path
+
+    return path
+
+
+def _storage_type(column: str, column_type: pa.DataType) -> pa.DataType:
+    if column in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), column_type)
+
+    return column_type
+
+
+def _encode(batch: pa.RecordBatch) -> pa.RecordBatch:
+    columns = [column.dictionary_encode() if name in DICTIONARY_COLUMNS else column
+               for name, column in zip(batch.schema.names, batch.columns)]
+
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def _write_atomic(path: str, batches, schema: pa.Schema):
+    with atomic_path(path) as temp_path, pq.ParquetWriter(temp_path, schema) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_batches([batch], schema=schema))
+
+
+def csv_to_parquet(csv_path: str, parquet_path: str):
+    '''convert a posts or submissions CSV, streaming it block by block'''
+    with open(csv_path, encoding='utf8') as file:
+        columns = file.readline().strip().split(',')
+
+    if columns == ['']:
+        column_types = dict()
+    else:
+        column_types = {c: POST_TYPES.get(c, pa.string()) for c in columns}
+
+    schema = pa.schema([(c, _storage_type(c, t)) for c, t in column_types.items()])
+
+    if not column_types:
+        _write_atomic(parquet_path, [], schema)
+        return
+
+    read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE)
+    convert_options = pa_csv.ConvertOptions(column_types=column_types,
+                                            strings_can_be_null=True)
+
+    reader = pa_csv.open_csv(csv_path, read_options=read_options,
+                             convert_options=convert_options)
+
+    _write_atomic(parquet_path, (_encode(batch) for batch in reader), schema)
+
+
+def authors_to_parquet(json_path: str, parquet_path: str):
+    author_df = pd.read_json(json_path)
+
+    column_types = {c: AUTHOR_TYPES.get(c, pa.string()) for c in author_df.columns}
+    schema = pa.schema(list(column_types.items()))
+
+    author_df = author_df.astype({c: 'Int64' for c, t in column_types.items()
+                                  if t == pa.int64()})
+    author_table = pa.Table.from_pandas(author_df, schema=schema, preserve_index=False)
+
+    _write_atomic(parquet_path, author_table.to_batches(), schema)
+
+
+def write_parquet(date_str: str, subreddit=SUBREDDIT, data_dir=DATA_DIR):
+    '''write the Parquet copy of a day's CSV/JSON snapshot'''
+    for table in ('posts', 'author_submissions'):
+        csv_path = snapshot_path(date_str, table, 'csv', subreddit, data_dir)
+        if os.path.exists(csv_path):
+            csv_to_parquet(csv_path, snapshot_path(date_str, table, 'parquet',
+                                                   subreddit, data_dir))
+
+    json_path = snapshot_path(date_str, 'authors', 'json', subreddit, data_dir)
+    if os.path.exists(json_path):
+        authors_to_parquet(json_path, snapshot_path(date_str, 'authors', 'parquet',
+                                                    subreddit, data_dir))
+
+
+def _decode(arrow_table: pa.Table) -> pa.Table:
+    for i, field in enumerate(arrow_table.schema):
+        if pa.types.is_dictionary(field.type):
+            column = pc.cast(arrow_table.column(i), field.type.value_type)
+            arrow_table = arrow_table.set_column(i, field.name, column)
+
+    return arrow_table
+
+
+def load(date_str: str, table: str, columns=None, subreddit=SUBREDDIT,
+         data_dir=DATA_DIR, categories=False, memory_map=True) -> pd.DataFrame:
+    '''read one table of a day's snapshot, preferring its Parquet copy
+
+    Only `columns` are read when given. Dictionary-encoded columns come back
+    as plain strings unless `categories` is set, in which case they are
+    pandas categoricals. Snapshots without a Parquet copy fall back to the
+    original CSV/JSON files.
+    '''
+    parquet_path = snapshot_path(date_str, table, 'parquet', subreddit, data_dir)
+
+    if os.path.exists(parquet_path):
+        arrow_table = pq.read_table(parquet_path, columns=columns,
+                                    memory_map=memory_map)
+        if not categories:
+            arrow_table = _decode(arrow_table)
+
+        df = arrow_table.to_pandas()
+
+        # missing strings come back as None; pd.read_csv gives NaN
+        for column in df.columns[df.dtypes == object]:
+            if column != 'moderator_of':
+                df[column] = df[column].where(df[column].notna(), np.nan)
+
+        if 'moderator_of' in df.columns:
+            df['moderator_of'] = df['moderator_of'].apply(lambda n: n if n is None else list(n))
+
+        return df
+
+    if table == 'authors':
+        df = pd.read_json(snapshot_path(date_str, table, 'json', subreddit, data_dir))
+        df = df if columns is None else df[columns]
+    else:
+        df = pd.read_csv(snapshot_path(date_str, table, 'csv', subreddit, data_dir),
+                         usecols=columns)
+
+    if categories:
+        df = df.astype({c: 'category' for c in DICTIONARY_COLUMNS if c in df.columns})
+
+    return df
+
+
+def main():
+    # backfill Parquet copies for every snapshot already in data/
+    for date_str in sorted(os.listdir(DATA_DIR)):
+        if os.path.isdir(os.path.join(DATA_DIR, date_str)):
+            write_parquet(date_str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import collections
+import os
+import sqlite3
+import threading
+
+
+# words kept in memory; headline vocabularies rarely get anywhere near this
+MAX_SIZE = 100_000
+
+# stems computed since the last write are flushed to disk in batches this big
+FLUSH_SIZE = 1000
+
+# sqlite's default limit on bound parameters per statement is 999
+MAX_VARIABLES = 900
+
+SCHEMA = '''
+create table if not exists stems (
+    word text primary key,
+    stem text not null
+);
+'''
+
+
+class StemCache:
+    '''word -> stem lookups in front of a stemmer
+
+    The most recently used stems are held in a bounded in-memory LRU. Given
+    a `path`, every stem computed is also stored in SQLite, so a run starts
+    with the words seen on earlier days already stemmed. `stats()` reports
+    how many lookups were served from memory, from disk and by the stemmer.
+    '''
+
+    def __init__(self, stem, max_size=MAX_SIZE, path=None):
+        self.stem = stem
+        self.max_size = max_size
+
+        self.stems = collections.OrderedDict()
+        self.pending = list()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+
+    def __call__(self, word: str) -> str:
+        return self.stem_many([word])[0]
+
+    def stem_many(self, words) -> list:
+        words = [str(w) for w in words]
+
+        with self.lock:
+            missing = list({w for w in words if w not in self.stems})
+
+            stored = self._read(missing)
+            computed = {w: self.stem(w) for w in missing if w not in stored}
+
+            self.disk_hits += len(stored)
+            self.misses += len(computed)
+            self.hits += len(words) - len(stored) - len(computed)
+
+            self.stems.update(stored)
+            self.stems.update(computed)
+            self.pending += computed.items()
+
+            stems = list()
+            for word in words:
+                self.stems.move_to_end(word)
+                stems.append(self.stems[word])
+
+            while len(self.stems) > self.max_size:
+                self.stems.popitem(last=False)
+
+            if len(self.pending) >= FLUSH_SIZE:
+                self._flush()
+
+            return stems
+
+    def _read(self, words: list) -> dict:
+        if self.connection is None or not words:
+            return dict()
+
+        stored = dict()
+        for i in range(0, len(words), MAX_VARIABLES):
+            chunk = words[i:i + MAX_VARIABLES]
+            placeholders = ', '.join('?' * len(chunk))
+            stored.update(self.connection.execute(
+                f'select word, stem from stems where word in ({placeholders})',
+                chunk).fetchall())
+
+        return stored
+
+    def _flush(self):
+        if self.connection is not None and self.pending:
+            with self.connection:
+                self.connection.executemany(
+                    'insert or replace into stems (word, stem) values (?, ?)',
+                    self.pending)
+
+        self.pending = list()
+
+    def save(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    'size': len(self.stems)}
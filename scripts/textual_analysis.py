@@ -1,111 +1,368 @@
+import atexit
+import collections
 import datetime as dt
+import functools
+import itertools
 import re
 from typing import Tuple
 import numpy as np
 import pandas as pd
 import string
 import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
 
-from nltk.corpus import stopwords
-from nltk.tokenize import RegexpTokenizer
-from nltk.stem import SnowballStemmer
+import snapshot
+
+from corpus import Corpus, CORPUS_PATH, TermCounts
+from metrics import Metrics
+from stem_cache import StemCache
 
 
 today = dt.date.today()
 today_str = today.strftime('%Y%m%d')
 
 WORD_PATTERN = re.compile(r'[a-zA-Z]+')
-STOPWORDS = np.r_[np.unique(stopwords.words('english')),
-                  np.unique(stopwords.words('spanish')),
-                  np.unique(['-', 'propaganda'])]
 
+# stems are kept between runs here; None keeps them in memory only
+STEM_CACHE_PATH = 'cache/stems.sqlite'
 
-stemmer = np.vectorize(SnowballStemmer('english', ignore_stopwords=True).stem)
-tokenizer = RegexpTokenizer('[A-Za-z]+').tokenize
+# distinct tf-idf scores per author kept in author_top_terms.parquet
+TOP_RANKS = 100
 
 
-def tokenize(text: str) -> Tuple[np.array, np.array]:
-    words = np.array(tokenizer(text))
+# NLTK and its corpora are slow to load, so they are only loaded on first use
+@functools.lru_cache(maxsize=None)
+def get_stopwords() -> frozenset:
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words('english') + stopwords.words('spanish')
+                     + ['-', 'propaganda'])
+
+
+@functools.lru_cache(maxsize=None)
+def get_stem_cache() -> StemCache:
+    from nltk.stem import SnowballStemmer
+
+    stemmer = SnowballStemmer('english', ignore_stopwords=True)
+    stem_cache = StemCache(stemmer.stem, path=STEM_CACHE_PATH)
+    atexit.register(stem_cache.close)
+
+    return stem_cache
+
+
+PUNCTUATION = frozenset(string.punctuation)
+
+# inputs are split into about this many chunks per worker process, so the
+# workers stay busy when some chunks take longer than others
+CHUNKS_PER_WORKER = 4
+
+# titles below which a chunk isn't worth shipping to another process
+MIN_CHUNK_SIZE = 1000
+
+Tokens = collections.namedtuple('Tokens', ['tokens', 'words', 'offsets'])
+
+
+def tokenize_many(texts, workers=1) -> Tokens:
+    '''tokenize a whole column of texts in one pass
+
+    The i-th text's tokens are `tokens[offsets[i]:offsets[i + 1]]`, and
+    `words` holds the word each token was stemmed from. With more than one
+    worker, large inputs are split into chunks tokenized in separate
+    processes.
+    '''
+    texts = list(texts)
+    bounds = chunk_bounds(len(texts), workers)
+
+    if len(bounds) <= 2:
+        return _tokenize_chunk(texts)
+
+    with process_pool(workers) as pool:
+        chunks = [texts[start:end] for start, end in zip(bounds, bounds[1:])]
+        return concat_tokens(list(pool.map(_tokenize_worker_chunk, chunks)))
+
+
+def _tokenize_chunk(texts: list) -> Tokens:
+    text_words = [WORD_PATTERN.findall(text) for text in texts]
+    words = list(itertools.chain.from_iterable(text_words))
+    tokens = get_stem_cache().stem_many(words)
 
-    if len(words) == 0:
-        return np.array([]), np.array([])
+    excluded = get_stopwords() | PUNCTUATION
+    keep = np.fromiter((len(t) > 1 and t not in excluded for t in tokens),
+                       dtype=bool, count=len(tokens))
 
-    tokens = np.array(stemmer(words))
+    text_ids = np.repeat(np.arange(len(text_words)), [len(n) for n in text_words])
+    kept_counts = np.bincount(text_ids[keep], minlength=len(text_words))
+    offsets = np.concatenate([[0], np.cumsum(kept_counts)])
 
-    not_too_short = np.vectorize(len)(tokens) > 1
-    tokens, words = tokens[not_too_short], words[not_too_short]
+    return Tokens(np.array(tokens, dtype=object)[keep],
+                  np.array(words, dtype=object)[keep],
+                  offsets)
 
-    not_stopword = np.isin(tokens, STOPWORDS, invert=True)
-    tokens, words = tokens[not_stopword], words[not_stopword]
 
-    not_punctuation = np.isin(tokens, list(string.punctuation), invert=True)
-    tokens, words = tokens[not_punctuation], words[not_punctuation]
+def _tokenize_worker_chunk(texts: list) -> Tokens:
+    title_tokens = _tokenize_chunk(texts)
 
-    return tokens, words
+    # pool workers exit without running atexit handlers
+    get_stem_cache().save()
 
+    return title_tokens
 
-def term_freq_by_inverse_document_freq():
-    target_snapshot_path = f'data/{today_str}/propaganda_author_submissions.csv'
-    submissions_df = pd.read_csv(target_snapshot_path)
 
-    target_features = ['author', 'title']
+def chunk_bounds(count: int, workers: int) -> list:
+    '''where to split `count` texts between `workers` processes'''
+    if workers <= 1:
+        return [0, count]
 
-    post = pd.DataFrame(submissions_df[target_features]).drop_duplicates()
+    chunk_size = max(MIN_CHUNK_SIZE, -(-count // (workers * CHUNKS_PER_WORKER)))
 
-    post['document'] = post.title.apply(tokenize)
-    post['words'] = post.document.apply(lambda n: list(n[1]))
-    post['document'] = post.document.apply(lambda n: list(n[0]))
+    return list(range(0, count, chunk_size)) + [count]
 
-    title_words = post[['title', 'words']].explode('words')
-    title_tokens = post[['title', 'document']].explode('document')
 
-    title_map = pd.concat([title_words, title_tokens['document']], axis=1)
-    title_map = title_map.reset_index()[['title', 'words', 'document']]
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    # workers are spawned rather than forked, so none of them inherits the
+    # parent's sqlite connections
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def concat_tokens(chunks: list) -> Tokens:
+    starts = np.cumsum([0] + [len(n.tokens) for n in chunks[:-1]])
+    offsets = [chunks[0].offsets[:1]] + [n.offsets[1:] + start
+                                         for n, start in zip(chunks, starts)]
+
+    return Tokens(np.concatenate([n.tokens for n in chunks]),
+                  np.concatenate([n.words for n in chunks]),
+                  np.concatenate(offsets))
+
+
+def tokenize(text: str) -> Tuple[np.array, np.array]:
+    tokens, words, _ = tokenize_many([text])
+
+    return tokens.astype(str), words.astype(str)
+
+
+@functools.lru_cache(maxsize=None)
+def get_corpus() -> Corpus:
+    corpus = Corpus(tokenize_many, CORPUS_PATH)
+    atexit.register(corpus.close)
+
+    return corpus
+
+
+def term_freq_by_inverse_document_freq(workers=1, metrics=None):
+    metrics = metrics or Metrics()
+
+    target_features = ['post_id', 'author', 'title']
+    submissions_df = snapshot.load(today_str, 'author_submissions', target_features)
+
+    post = pd.DataFrame(submissions_df[['author', 'title']]).drop_duplicates()
+
+    corpus = get_corpus()
+    corpus_dates = corpus.dates()
+
+    if corpus_dates and today_str < corpus_dates[-1]:
+        # the corpus only moves forward; older snapshots are analyzed in full
+        title_tokens, term_counts = tokenize_and_count(post.author, post.title, workers)
+    else:
+        # only the titles that are new since the last snapshot get tokenized
+        corpus.update(today_str, submissions_df, workers)
+        title_tokens = Tokens(*corpus.title_tokens(post.title))
+        term_counts = corpus.term_counts()
+
+    # one row per token, and an empty row for titles left without any
+    token_counts = np.diff(title_tokens.offsets)
+    title_map = pd.DataFrame({'title': post.title.to_numpy().repeat(token_counts),
+                              'words': title_tokens.words,
+                              'document': title_tokens.tokens,
+                              'position': np.repeat(np.arange(len(post)), token_counts)})
+    empty_titles = pd.DataFrame({'title': post.title[token_counts == 0],
+                                 'position': np.flatnonzero(token_counts == 0)})
+    title_map = pd.concat([title_map, empty_titles]).sort_values('position', kind='stable')
+    title_map = title_map[['title', 'words', 'document']]
     title_map.to_csv(f'data/{today_str}/title_terms.csv', index=False, encoding='utf8')
 
-    # concatanate all titles into a single document per author
-    author = post[['author', 'document', 'words']].groupby('author').sum()
+    term_table = author_term_table(post.author, title_tokens, term_counts)
+
+    author_terms = author_term_scores(term_table, np.unique(post.author.to_numpy()))
+    with open(f'data/{today_str}/author_terms.json', 'w') as file:
+        json.dump(author_terms, file)
+
+    # the report's buzzwords only need each author's best terms
+    top_terms = top_author_terms(term_table)
+    top_terms.to_parquet(f'data/{today_str}/author_top_terms.parquet', index=False)
+
+    metrics.rows('analyze', 'author_submissions', len(submissions_df))
+    metrics.rows('analyze', 'title_terms', len(title_map))
+    metrics.rows('analyze', 'author_terms', len(term_table))
+    metrics.rows('analyze', 'author_top_terms', len(top_terms))
+
+    # titles from the corpus or stemmed by the workers never reach this
+    # process's cache
+    stem_stats = get_stem_cache().stats()
+    if stem_stats['hits'] + stem_stats['disk_hits'] + stem_stats['misses']:
+        print(f'stem cache hit rate: {stem_stats["hit_rate"]:.1%} '
+              f'({stem_stats["misses"]} words stemmed)')
+
+
+def count_terms(authors: pd.Series, title_tokens: Tokens) -> TermCounts:
+    '''author x term counts of the titles `authors` posted'''
+    author_names, title_author_ids = np.unique(authors.to_numpy(), return_inverse=True)
+    token_author_ids = np.repeat(title_author_ids, np.diff(title_tokens.offsets))
+
+    vocabulary, token_term_ids = np.unique(title_tokens.tokens, return_inverse=True)
+    shape = (len(author_names), len(vocabulary))
+
+    # duplicate entries are summed on conversion
+    counts = sparse.coo_matrix((np.ones(len(token_term_ids), dtype=np.int64),
+                                (token_author_ids, token_term_ids)), shape=shape).tocsr()
+    counts.sum_duplicates()
+
+    doc_freq = np.bincount(counts.indices, minlength=len(vocabulary))
+
+    return TermCounts(author_names, vocabulary, counts, doc_freq)
+
+
+def _tokenize_and_count_chunk(authors: list, titles: list) -> tuple:
+    title_tokens = _tokenize_worker_chunk(titles)
+
+    return title_tokens, count_terms(pd.Series(authors, dtype=object), title_tokens)
+
+
+def tokenize_and_count(authors: pd.Series, titles: pd.Series, workers=1) -> tuple:
+    '''tokenize_many and count_terms, split between `workers` processes
+
+    Each chunk of titles is tokenized and counted on its own; the chunks'
+    counts are then merged, so the result matches the serial one exactly.
+    '''
+    authors, titles = list(authors), list(titles)
+    bounds = chunk_bounds(len(titles), workers)
+
+    if len(bounds) <= 2:
+        title_tokens = _tokenize_chunk(titles)
+        return title_tokens, count_terms(pd.Series(authors, dtype=object), title_tokens)
+
+    with process_pool(workers) as pool:
+        chunks = list(pool.map(_tokenize_and_count_chunk,
+                               [authors[start:end] for start, end in zip(bounds, bounds[1:])],
+                               [titles[start:end] for start, end in zip(bounds, bounds[1:])]))
+
+    return (concat_tokens([tokens for tokens, _ in chunks]),
+            merge_term_counts([counts for _, counts in chunks]))
+
+
+def merge_term_counts(chunks: list) -> TermCounts:
+    '''sum the term counts of several chunks of titles'''
+    authors = np.unique(np.concatenate([n.authors for n in chunks]))
+    vocabulary = np.unique(np.concatenate([n.vocabulary for n in chunks]))
+
+    rows, columns = list(), list()
+    for n in chunks:
+        chunk_rows = np.repeat(np.arange(len(n.authors)), np.diff(n.counts.indptr))
+        rows.append(np.searchsorted(authors, n.authors)[chunk_rows])
+        columns.append(np.searchsorted(vocabulary, n.vocabulary)[n.counts.indices])
+
+    counts = sparse.coo_matrix((np.concatenate([n.counts.data for n in chunks]),
+                                (np.concatenate(rows), np.concatenate(columns))),
+                               shape=(len(authors), len(vocabulary))).tocsr()
+    counts.sum_duplicates()
+
+    # an author can span several chunks, so frequencies are counted afresh
+    doc_freq = np.bincount(counts.indices, minlength=len(vocabulary))
+
+    return TermCounts(authors, vocabulary, counts, doc_freq)
+
+
+def term_tf_idf(term_counts: TermCounts) -> np.array:
+    '''tf-idf of every entry of `term_counts.counts`, each author as one document'''
+    counts = term_counts.counts
+    inverse_doc_freq = np.log10(len(term_counts.authors)
+                                / np.maximum(term_counts.doc_freq, 1))
+
+    # term frequency relative to the number of distinct terms an author used
+    distinct_terms = np.diff(counts.indptr)
+    term_freq = counts.data / np.repeat(distinct_terms, distinct_terms)
+
+    return term_freq * inverse_doc_freq[counts.indices]
+
+
+def term_scores(start_str=None, end_str=None) -> pd.DataFrame:
+    '''every author's term counts and tf-idf over the snapshots in a window
+
+    Without dates, the latest snapshot added to the corpus is scored.
+    '''
+    term_counts = get_corpus().term_counts(start_str, end_str)
+    counts = term_counts.counts
+
+    return pd.DataFrame({'author': np.repeat(term_counts.authors, np.diff(counts.indptr)),
+                         'term': term_counts.vocabulary[counts.indices],
+                         'count': counts.data,
+                         'tf_idf': term_tf_idf(term_counts)})
+
+
+def author_term_table(authors: pd.Series, title_tokens: Tokens, term_counts=None) -> pd.DataFrame:
+    '''one row per word each author used, with its stem's tf-idf and count
+
+    `title_tokens` are the tokens of the titles `authors` posted, from
+    tokenize_many; `term_counts` are counted from them unless given. Rows
+    are grouped by author, in the order the author first used each word.
+    '''
+    if term_counts is None:
+        term_counts = count_terms(authors, title_tokens)
+
+    counts = term_counts.counts
+    shape = counts.shape
+    tf_idf = term_tf_idf(term_counts)
+
+    # one entry per token occurrence, in title order
+    title_author_ids = np.searchsorted(term_counts.authors, authors.to_numpy())
+    token_author_ids = np.repeat(title_author_ids, np.diff(title_tokens.offsets))
+    token_term_ids = np.searchsorted(term_counts.vocabulary, title_tokens.tokens)
 
-    unique_terms = np.unique(np.concatenate(np.array(author.document.apply(np.array))))
-    doc_freq_map = dict()
-    for term in unique_terms:
-        try:
-            doc_freq_map[term] += 1
-        except KeyError:
-            doc_freq_map[term] = 1
+    # first use of each word per author, grouped by author in a stable order
+    first_use = pd.DataFrame({'author': token_author_ids, 'word': title_tokens.words})
+    first_use = first_use.drop_duplicates().index.to_numpy()
+    first_use = first_use[np.argsort(token_author_ids[first_use], kind='stable')]
 
-    for term in unique_terms:
-        doc_freq_map[term] = np.log10(len(author.document) / doc_freq_map[term])
+    # csr entries are ordered by (author, term), so they can be located by key
+    distinct_terms = np.diff(counts.indptr)
+    entry_keys = np.repeat(np.arange(shape[0]), distinct_terms) * shape[1] + counts.indices
+    token_keys = token_author_ids[first_use] * shape[1] + token_term_ids[first_use]
+    entries = np.searchsorted(entry_keys, token_keys)
 
-    doc_freq = np.vectorize(doc_freq_map.get)
+    return pd.DataFrame({'author': term_counts.authors[token_author_ids[first_use]],
+                         'term': title_tokens.words[first_use],
+                         'token': title_tokens.tokens[first_use],
+                         'tf_idf': tf_idf[entries],
+                         'count': counts.data[entries]})
 
-    def tf_idf_func(tokens, occurrences):
-        return (occurrences / len(occurrences)) * doc_freq(tokens)
 
-    term_counts = author.document.apply(lambda n: np.unique(n, return_counts=True))
+def author_term_scores(term_table: pd.DataFrame, authors: np.array) -> list:
+    '''author_terms.json records; tf-idf and count are kept as strings'''
+    terms = pd.DataFrame({'term': term_table.term,
+                          'tf_idf': term_table.tf_idf.to_numpy().astype(str),
+                          'count': term_table['count'].to_numpy().astype(str)})
+    terms = terms.to_dict('records')
 
-    # n[0] is an author's token vector
-    # n[1] is an author's occurrence vector
-    tf_idf = term_counts.apply(lambda n: (n[0], tf_idf_func(n[0], n[1]), n[1]))
+    bounds = np.searchsorted(term_table.author.to_numpy(), authors, side='left')
+    bounds = np.append(bounds, len(terms))
 
-    # zips the token and occurrence vectors for each author into an array of tuples
-    tf_idf = tf_idf.apply(lambda n: np.stack(n, axis=1))
+    return [{'author': author, 'terms': terms[bounds[i]:bounds[i + 1]]}
+            for i, author in enumerate(authors)]
 
-    # convert tuples to dictionaries and add to author dataframe
-    author['tf_idf'] = tf_idf.apply(lambda d: {n[0]: n[1] for n in d})
-    author['term_counts'] = tf_idf.apply(lambda d: {n[0]: n[2] for n in d})
-    author = pd.DataFrame(author[['document', 'words', 'tf_idf', 'term_counts']])
 
-    words = author.apply(lambda n: {w: (n['tf_idf'][t], n['term_counts'][t])
-                                    for t, w in list(zip(n['document'], n['words']))}, axis=1)
+def top_author_terms(term_table: pd.DataFrame, ranks=TOP_RANKS) -> pd.DataFrame:
+    '''each author's words with the `ranks` highest tf-idf scores
 
-    words = words.apply(lambda n: [{'term': term, 'tf_idf': tf_idf, 'count': count}
-                                   for term, (tf_idf, count) in n.items()])
+    Ranks are dense, so words sharing a stem (and so a score) share a rank.
+    Rows are sorted by author, rank and stem, words in order of first use.
+    '''
+    rank = term_table.groupby('author', sort=False)['tf_idf'].rank(method='dense',
+                                                                   ascending=False)
 
-    words_json = list()
-    for author in words.index:
-        words_json.append({'author': author,
-                           'terms': words[author]})
+    top_terms = term_table.assign(rank=rank.astype(np.int64))
+    top_terms = top_terms[top_terms['rank'] <= ranks]
+    top_terms = top_terms.sort_values(['author', 'rank', 'token'], kind='stable')
 
-    json.dump(words_json, open(f'data/{today_str}/author_terms.json', 'w'))
+    return top_terms[['author', 'rank', 'token', 'term', 'tf_idf', 'count']]
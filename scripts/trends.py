@@ -0,0 +1,191 @@
+import hashlib
+import os
+
+import pandas as pd
+
+import snapshot
+
+from atomic import atomic_path
+from catalog import Catalog
+
+
+TRENDS_DIR = 'cache/trends'
+
+# per-snapshot aggregates; each is a small table cached as Parquet
+AGGREGATES = ('totals', 'authors', 'domains')
+
+AUTHOR_COLUMNS = ('post_karma', 'comment_karma', 'moderated', 'suspended')
+
+WEEK = 7
+
+
+def aggregate(date_str: str, subreddit=snapshot.SUBREDDIT,
+              data_dir=snapshot.DATA_DIR, has_authors=True) -> dict:
+    '''the small tables the trends are built from, for one snapshot'''
+    posts_df = snapshot.load(date_str, 'posts',
+                             ['author', 'domain', 'score', 'comments_count'],
+                             subreddit, data_dir)
+
+    author_df = posts_df.groupby('author').agg(posts=('score', 'size'),
+                                               score=('score', 'sum'),
+                                               comments=('comments_count', 'sum'))
+
+    if has_authors:
+        profile_df = snapshot.load(date_str, 'authors', subreddit=subreddit,
+                                   data_dir=data_dir).set_index('username')
+        profile_df['moderated'] = profile_df.moderator_of.apply(
+            lambda n: len(n) if isinstance(n, list) else 0)
+        profile_df = profile_df.reindex(columns=AUTHOR_COLUMNS)
+    else:
+        profile_df = pd.DataFrame(columns=AUTHOR_COLUMNS)
+
+    author_df = author_df.join(profile_df.astype({'post_karma': float,
+                                                  'comment_karma': float,
+                                                  'moderated': float,
+                                                  'suspended': float}))
+
+    # text posts have no domain
+    domain_df = posts_df.groupby('domain').agg(posts=('score', 'size'),
+                                               score=('score', 'sum'))
+
+    totals_df = pd.DataFrame({'posts': [len(posts_df)],
+                              'authors': [posts_df.author.nunique()],
+                              'score': [posts_df.score.sum()],
+                              'comments': [posts_df.comments_count.sum()]})
+
+    return {'totals': totals_df,
+            'authors': author_df.reset_index(),
+            'domains': domain_df.reset_index()}
+
+
+class Trends:
+    '''trend queries over every snapshot in data/
+
+    Each snapshot is boiled down once to a few small aggregates (see
+    `aggregate`), cached under cache/trends by the content hash of the
+    files they were computed from, so older snapshots are never parsed
+    again unless their files change.
+    '''
+
+    def __init__(self, subreddit=snapshot.SUBREDDIT, data_dir=snapshot.DATA_DIR,
+                 directory=TRENDS_DIR):
+        self.subreddit = subreddit
+        self.data_dir = data_dir
+        self.directory = directory
+
+        self.catalog = Catalog.load(data_dir)
+        self.catalog.refresh()
+
+        self._aggregates = dict()
+
+    def _file(self, date_str: str, table: str):
+        # the original csv/json, so writing a Parquet copy keeps the key
+        entries = [f for f in self.catalog.files(date_str, table)
+                   if f['subreddit'] == self.subreddit]
+
+        return entries[-1] if entries else None
+
+    def dates(self) -> list:
+        return [d for d in self.catalog.dates(('posts',))
+                if self._file(d, 'posts') is not None]
+
+    def key(self, date_str: str) -> str:
+        '''hash of the content of the files the snapshot's aggregates use'''
+        sha256 = hashlib.sha256()
+        for table in ('posts', 'authors'):
+            entry = self._file(date_str, table)
+            sha256.update(f'{table}:{entry["sha256"] if entry else None};'.encode())
+
+        return sha256.hexdigest()
+
+    def aggregates(self, date_str: str) -> dict:
+        if date_str in self._aggregates:
+            return self._aggregates[date_str]
+
+        directory = os.path.join(self.directory, self.key(date_str))
+
+        if os.path.isdir(directory):
+            aggregates = {name: pd.read_parquet(os.path.join(directory, f'{name}.parquet'))
+                          for name in AGGREGATES}
+        else:
+            has_authors = self._file(date_str, 'authors') is not None
+            aggregates = aggregate(date_str, self.subreddit, self.data_dir, has_authors)
+            self._store(directory, aggregates)
+
+        self._aggregates[date_str] = aggregates
+
+        return aggregates
+
+    @staticmethod
+    def _store(directory: str, aggregates: dict):
+        with atomic_path(directory) as temp_directory:
+            os.makedirs(temp_directory)
+
+            for name, df in aggregates.items():
+                df.to_parquet(os.path.join(temp_directory, f'{name}.parquet'), index=False)
+
+    def table(self, name: str, dates=None) -> pd.DataFrame:
+        '''one aggregate across snapshots, with a date column'''
+        dates = self.dates() if dates is None else dates
+
+        return pd.concat([self.aggregates(d)[name].assign(date=d) for d in dates],
+                         ignore_index=True)
+
+    def weekly_dates(self, weeks: int, end_str=None) -> list:
+        '''the latest snapshot at or before each of the last `weeks` week ends'''
+        dates = self.dates()
+        end_str = end_str or dates[-1]
+
+        weekly = list()
+        for week in range(weeks):
+            date_str = self.catalog.latest_before(end_str, week * WEEK, ('posts',))
+            if date_str is not None and date_str not in weekly:
+                weekly.append(date_str)
+
+        return sorted(weekly)
+
+    def trend(self, name='totals', weeks=4, end_str=None, index=None, value=None) -> pd.DataFrame:
+        '''week by week values of an aggregate, one column per weekly snapshot
+
+        For the authors and domains aggregates, `index` is the key column
+        and `value` the measure to follow (posts by default).
+        '''
+        weekly = self.table(name, self.weekly_dates(weeks, end_str))
+
+        if name == 'totals':
+            return weekly.set_index('date')
+
+        index = index or ('author' if name == 'authors' else 'domain')
+        value = value or 'posts'
+
+        return weekly.pivot_table(index=index, columns='date', values=value,
+                                  aggfunc='sum', fill_value=0)
+
+    def week_over_week(self, name='authors', end_str=None, value='posts') -> pd.DataFrame:
+        '''this week's value next to last week's, with the change'''
+        trend = self.trend(name, 2, end_str, value=value)
+
+        if trend.shape[1] < 2:
+            raise FileNotFoundError(f'no snapshot {WEEK} or more days before '
+                                    f'{trend.columns[-1]}')
+
+        last_week, this_week = trend.columns[-2:]
+        change = pd.DataFrame({'last_week': trend[last_week],
+                               'this_week': trend[this_week]})
+        change['change'] = change.this_week - change.last_week
+
+        return change.sort_values('change', ascending=False)
+
+
+def main(weeks=4):
+    trends = Trends()
+
+    print(trends.trend('totals', weeks).to_markdown())
+    print()
+
+    domains = trends.week_over_week('domains')
+    print(domains[domains.change != 0].head(10).to_markdown())
+
+
+if __name__ == '__main__':
+    main()